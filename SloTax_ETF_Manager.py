@@ -2,13 +2,443 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import json
-import csv
-from datetime import datetime
-from collections import deque
-import xml.etree.ElementTree as ET
-import xml.dom.minidom
-import copy
 import os
+from collections import Counter
+from datetime import datetime
+
+from slotax.accounts import ACCOUNTS_FILE, DEFAULT_ACCOUNT, Account, AccountSet, read_accounts, write_accounts
+from slotax.actions import (ACTIONS_FILE, RENAME, SPLIT, CorporateAction, CorporateActions, new_action_id,
+                            parse_ratio, read_actions, write_actions)
+from slotax.diagnostics import instrument, tracer
+from slotax.fifo import InsufficientLotsError
+from slotax.fxrates import MissingRateError, RateStore
+from slotax.importer import ImportFormatError, import_file
+from slotax.jobs import JobRunner
+from slotax.kdvp import write_kdvp_file
+from slotax.model import EUR, Transaction, TxType, date_ordinal, format_date
+from slotax.storage import export_csv, new_transaction_id
+from slotax.table import RowFilter, SortedRows, format_row
+from slotax.whatif import SaleSimulator
+
+
+class VirtualTreeview(ttk.Frame):
+    """
+    A Treeview with a scrollbar that only holds Tk items for the rows that
+    are currently visible. The rows themselves live in a SortedRows model;
+    scrolling re-renders the visible slice, so the cost of scrolling, adding
+    or deleting does not depend on the number of transactions.
+    Selection is tracked in the model, so it survives scrolling.
+    """
+    WHEEL_STEP = 3
+
+    def __init__(self, master, rows, columns, format_row, **kwargs):
+        super().__init__(master, **kwargs)
+        self.rows = rows
+        self.format_row = format_row
+        self.top = 0          # Position of the first visible row
+        self.page = 1         # Number of rows that fit into the widget
+        self.selected = set()
+        self._row_height = None
+        self._header_height = 0
+
+        self.tree = ttk.Treeview(self, columns=columns, show="headings")
+        self.scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self.yview)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        self.tree.bind("<Configure>", lambda event: self._measure())
+        self.tree.bind("<<TreeviewSelect>>", self._on_select)
+        self.tree.bind("<MouseWheel>", self._on_wheel)
+        self.tree.bind("<Button-4>", self._on_wheel)
+        self.tree.bind("<Button-5>", self._on_wheel)
+        self.tree.bind("<Up>", self._on_key)
+        self.tree.bind("<Down>", self._on_key)
+        self.tree.bind("<Prior>", self._on_key)
+        self.tree.bind("<Next>", self._on_key)
+        self.tree.bind("<Control-a>", lambda event: self.select_all())
+
+    @instrument("table.refresh")
+    def refresh(self):
+        """Re-renders the visible slice of rows."""
+        total = len(self.rows)
+        self.top = max(0, min(self.top, total - self.page))
+        visible = self.rows.iids(self.top, self.top + self.page)
+
+        self.tree.delete(*self.tree.get_children())
+        for iid in visible:
+            self.tree.insert("", tk.END, iid=iid, values=self.format_row(self.rows[iid]))
+        self.tree.selection_set([iid for iid in visible if iid in self.selected])
+
+        if total:
+            self.scrollbar.set(self.top / total, min(1.0, (self.top + self.page) / total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+        if self._row_height is None and visible:
+            self.after_idle(self._measure)
+
+    def see(self, iid):
+        """Scrolls so that the given row is visible, unless the filter hides it."""
+        index = self.rows.index(iid)
+        if index is not None and not self.top <= index < self.top + self.page:
+            self.top = max(0, index - self.page // 2)
+        self.refresh()
+
+    def discard(self, iids):
+        """Forgets the selection of rows that were removed from the model."""
+        self.selected.difference_update(iids)
+
+    def select_all(self):
+        self.selected = set(self.rows.iids())
+        self.refresh()
+        return "break"
+
+    def yview(self, *args):
+        """Scrollbar callback."""
+        if args[0] == "moveto":
+            self.top = int(float(args[1]) * len(self.rows))
+        elif args[0] == "scroll":
+            step = self.page if args[2] == "pages" else 1
+            self.top += int(args[1]) * step
+        self.refresh()
+
+    def _measure(self):
+        """Works out how many rows fit, using the height of a rendered row."""
+        children = self.tree.get_children()
+        bbox = self.tree.bbox(children[0]) if children else ""
+        if bbox:
+            self._header_height, self._row_height = bbox[1], bbox[3]
+        row_height = self._row_height or 20
+        page = max(1, (self.tree.winfo_height() - self._header_height) // row_height)
+        if page != self.page:
+            self.page = page
+            self.refresh()
+
+    def _on_select(self, event):
+        self.selected.difference_update(self.tree.get_children())
+        self.selected.update(self.tree.selection())
+
+    def _on_wheel(self, event):
+        if event.num == 4:
+            units = -1
+        elif event.num == 5:
+            units = 1
+        else:
+            units = -1 if event.delta > 0 else 1
+        self.top += units * self.WHEEL_STEP
+        self.refresh()
+        return "break"
+
+    def _on_key(self, event):
+        if event.keysym in ("Prior", "Next"):
+            self.yview("scroll", -1 if event.keysym == "Prior" else 1, "pages")
+            return "break"
+
+        # Up/Down inside the visible slice are handled by the Treeview itself
+        children = self.tree.get_children()
+        focus = self.tree.focus()
+        if not children or focus not in (children[0], children[-1]):
+            return None
+        position = self.top + children.index(focus) + (1 if event.keysym == "Down" else -1)
+        if not 0 <= position < len(self.rows):
+            return "break"
+        if position < self.top or position >= self.top + len(children):
+            iid = self.rows.iids(position, position + 1)[0]
+            self.selected = {iid}
+            self.see(iid)
+            self.tree.focus(iid)
+            return "break"
+        return None
+
+
+class DiagnosticsWindow(tk.Toplevel):
+    """
+    Optional panel with the timings recorded by slotax.diagnostics: calls,
+    total and longest wall time and peak allocation per operation. Recording
+    is off until it is switched on here; the table refreshes every second.
+    """
+    REFRESH_MS = 1000
+
+    def __init__(self, master):
+        super().__init__(master)
+        self.title("Diagnostika")
+        self.geometry("640x320")
+
+        controls = ttk.Frame(self, padding="5")
+        controls.pack(side=tk.TOP, fill=tk.X)
+        self.enabled_var = tk.BooleanVar(value=tracer.enabled)
+        self.memory_var = tk.BooleanVar(value=tracer.memory)
+        ttk.Checkbutton(controls, text="Merjenje", variable=self.enabled_var,
+                        command=self._toggle).pack(side=tk.LEFT)
+        ttk.Checkbutton(controls, text="Pomnilnik (tracemalloc, počasneje)", variable=self.memory_var,
+                        command=self._toggle).pack(side=tk.LEFT, padx=10)
+        ttk.Button(controls, text="Izvozi sled", command=self._export).pack(side=tk.RIGHT)
+        ttk.Button(controls, text="Ponastavi", command=self._clear).pack(side=tk.RIGHT, padx=5)
+
+        columns = ("Operacija", "Klici", "Skupaj (ms)", "Najdlje (ms)", "Vrh pomnilnika (KiB)")
+        self.tree = ttk.Treeview(self, columns=columns, show="headings")
+        for col in columns:
+            self.tree.heading(col, text=col)
+            self.tree.column(col, width=110, anchor=tk.E)
+        self.tree.column("Operacija", width=160, anchor=tk.W)
+        self.tree.pack(fill=tk.BOTH, expand=True, padx=5, pady=(0, 5))
+
+        self._after_id = None
+        self._update()
+
+    def destroy(self):
+        if self._after_id is not None:
+            self.after_cancel(self._after_id)
+            self._after_id = None
+        super().destroy()
+
+    def _toggle(self):
+        if self.enabled_var.get():
+            tracer.enable(memory=self.memory_var.get())
+        else:
+            tracer.disable()
+
+    def _clear(self):
+        tracer.clear()
+        self._update(reschedule=False)
+
+    def _export(self):
+        filename = filedialog.asksaveasfilename(
+            parent=self,
+            defaultextension=".json",
+            filetypes=[("Chrome trace", "*.json"), ("Vse datoteke", "*.*")],
+            title="Izvozi sled",
+            initialfile="slotax-trace.json"
+        )
+        if not filename:
+            return
+        try:
+            events = tracer.export_chrome_trace(filename)
+        except IOError:
+            messagebox.showerror("Napaka pri izvozu", f"Datoteke '{filename}' ni mogoče zapisati.", parent=self)
+            return
+        messagebox.showinfo("Uspeh", f"Izvoženih {events} dogodkov v '{filename}'.", parent=self)
+
+    def _update(self, reschedule=True):
+        self.tree.delete(*self.tree.get_children())
+        for stats in tracer.summary():
+            peak = f"{stats.peak / 1024:.0f}" if stats.peak is not None else ""
+            self.tree.insert("", tk.END, values=(
+                stats.name, stats.calls, f"{stats.total * 1000:.1f}", f"{stats.max * 1000:.1f}", peak
+            ))
+        if reschedule:
+            self._after_id = self.after(self.REFRESH_MS, self._update)
+
+
+class SaleSimulatorWindow(tk.Toplevel):
+    """
+    What-if panel: the gain and tax of selling part of a position on a date.
+    The slider sweeps the quantity; every position is answered from the
+    prefix sums of the open lots, so the numbers and the gain curve follow
+    the slider without delay.
+    """
+    CURVE_POINTS = 100
+    WIDTH, HEIGHT, MARGIN = 520, 220, 30
+
+    def __init__(self, app):
+        super().__init__(app.root)
+        self.app = app
+        self.simulator = None
+        self.curve = []
+        self.title("Simulacija prodaje")
+        self.resizable(False, False)
+
+        form = ttk.Frame(self, padding="10")
+        form.pack(side=tk.TOP, fill=tk.X)
+        ttk.Label(form, text="Ticker:").grid(row=0, column=0, sticky=tk.W, pady=2)
+        self.ticker_combo = ttk.Combobox(form, values=sorted(app.engine.ledgers), state="readonly", width=16)
+        self.ticker_combo.grid(row=0, column=1, sticky=tk.W, pady=2)
+        ttk.Label(form, text="Datum (DD.MM.YYYY):").grid(row=0, column=2, sticky=tk.W, padx=(10, 0), pady=2)
+        self.date_entry = ttk.Entry(form, width=12)
+        self.date_entry.grid(row=0, column=3, sticky=tk.W, pady=2)
+        self.date_entry.insert(0, datetime.now().strftime("%d.%m.%Y"))
+        ttk.Label(form, text="Cena/enoto:").grid(row=1, column=0, sticky=tk.W, pady=2)
+        self.price_entry = ttk.Entry(form, width=12)
+        self.price_entry.grid(row=1, column=1, sticky=tk.W, pady=2)
+        ttk.Label(form, text="Stroški prodaje:").grid(row=1, column=2, sticky=tk.W, padx=(10, 0), pady=2)
+        self.costs_entry = ttk.Entry(form, width=12)
+        self.costs_entry.grid(row=1, column=3, sticky=tk.W, pady=2)
+        self.costs_entry.insert(0, "0.0")
+        ttk.Button(form, text="Izračunaj", command=self.recalculate).grid(row=0, column=4, rowspan=2, padx=(10, 0))
+
+        self.quantity_var = tk.DoubleVar(value=0.0)
+        self.scale = ttk.Scale(self, from_=0.0, to=0.0, variable=self.quantity_var, command=self._on_slide,
+                               length=self.WIDTH)
+        self.scale.pack(padx=10)
+        self.result_label = ttk.Label(self, text="Izberite ticker, vnesite ceno in kliknite Izračunaj.", padding="5")
+        self.result_label.pack(fill=tk.X, padx=5)
+        self.canvas = tk.Canvas(self, width=self.WIDTH, height=self.HEIGHT, background="white")
+        self.canvas.pack(padx=10, pady=(0, 10))
+
+        self.ticker_combo.bind("<<ComboboxSelected>>", lambda event: self.recalculate())
+        self.bind("<Return>", lambda event: self.recalculate())
+
+    def recalculate(self):
+        """Rebuilds the curve for the ticker, date, price and costs in the form."""
+        ticker = self.ticker_combo.get()
+        if not ticker:
+            return
+        if self.app.engine_busy():
+            self.result_label.config(text="Počakajte, da se izračun v ozadju konča.")
+            return
+        try:
+            ordinal = date_ordinal(self.date_entry.get().strip())
+            price = float(self.price_entry.get().replace(',', '.'))
+            costs = float(self.costs_entry.get().replace(',', '.'))
+        except ValueError:
+            self.result_label.config(text="Napaka: vnesite veljaven datum, ceno in stroške.")
+            return
+
+        if self.simulator is None or self.simulator.engine is not self.app.engine \
+                or self.simulator.rates is not self.app.rates:
+            self.simulator = SaleSimulator(self.app.engine, self.app.rates)
+        try:
+            index = self.simulator.lot_index(ticker, ordinal)
+        except (KeyError, InsufficientLotsError, MissingRateError) as e:
+            self.result_label.config(text=str(e))
+            return
+        self.ordinal, self.price, self.costs = ordinal, price, costs
+        self.curve = self.simulator.curve(ticker, ordinal, price, costs, self.CURVE_POINTS) if index.available else []
+        self.scale.config(to=index.available)
+        self.quantity_var.set(index.available)
+        self._on_slide()
+
+    def _on_slide(self, *args):
+        if not self.curve:
+            self.result_label.config(text="Na ta dan ni odprtih pozicij.")
+            self.canvas.delete("all")
+            return
+        if self.app.engine_busy():
+            self.result_label.config(text="Počakajte, da se izračun v ozadju konča.")
+            return
+        quantity = self.quantity_var.get()
+        try:
+            estimate = self.simulator.simulate(self.ticker_combo.get(), self.ordinal, quantity, self.price, self.costs)
+        except (KeyError, ValueError, InsufficientLotsError) as e:
+            self.result_label.config(text=str(e))
+            return
+        self.result_label.config(text=(
+            f"Količina: {estimate.quantity:.4f}   Izkupiček: {estimate.proceeds:.2f} €   "
+            f"Nabavna vrednost: {estimate.cost_basis:.2f} €   Dobiček: {estimate.gain:.2f} €   "
+            f"Ocena davka: {estimate.tax:.2f} €"
+        ))
+        self._draw(estimate)
+
+    def _draw(self, current):
+        """Draws gain over quantity, with the zero line and the slider position."""
+        c, w, h, m = self.canvas, self.WIDTH, self.HEIGHT, self.MARGIN
+        c.delete("all")
+        max_quantity = self.curve[-1].quantity or 1.0
+        gains = [point.gain for point in self.curve] + [0.0]
+        low, high = min(gains), max(gains)
+        span = (high - low) or 1.0
+
+        def x(quantity):
+            return m + (w - 2 * m) * quantity / max_quantity
+
+        def y(gain):
+            return h - m - (h - 2 * m) * (gain - low) / span
+
+        c.create_line(m, y(0.0), w - m, y(0.0), fill="gray", dash=(2, 2))
+        c.create_line(*[coordinate for point in self.curve for coordinate in (x(point.quantity), y(point.gain))],
+                      fill="blue", width=2)
+        c.create_line(x(current.quantity), m, x(current.quantity), h - m, fill="red")
+        c.create_text(m, m / 2, text=f"{high:.2f} €", anchor=tk.W)
+        c.create_text(m, h - m / 2, text=f"{low:.2f} €", anchor=tk.W)
+        c.create_text(w - m, h - m / 2, text=f"{max_quantity:.4f}", anchor=tk.E)
+
+
+class CorporateActionsWindow(tk.Toplevel):
+    """
+    Splits, reverse splits and ticker changes. They are kept apart from the
+    transactions, which stay as entered; FIFO applies them while matching.
+    Every change is saved to actions.json and the ledgers are rebuilt.
+    """
+    KINDS = {"Razdelitev/združitev": SPLIT, "Preimenovanje": RENAME}
+
+    def __init__(self, app):
+        super().__init__(app.root)
+        self.app = app
+        self.title("Korporacijski dogodki")
+        self.geometry("560x360")
+
+        form = ttk.Frame(self, padding="10")
+        form.pack(side=tk.TOP, fill=tk.X)
+        ttk.Label(form, text="Datum (DD.MM.YYYY):").grid(row=0, column=0, sticky=tk.W, pady=2)
+        self.date_entry = ttk.Entry(form, width=12)
+        self.date_entry.grid(row=0, column=1, sticky=tk.W, pady=2)
+        ttk.Label(form, text="Vrsta:").grid(row=0, column=2, sticky=tk.W, padx=(10, 0), pady=2)
+        self.kind_combo = ttk.Combobox(form, values=list(self.KINDS), state="readonly", width=20)
+        self.kind_combo.grid(row=0, column=3, sticky=tk.W, pady=2)
+        self.kind_combo.set("Razdelitev/združitev")
+        ttk.Label(form, text="Ticker:").grid(row=1, column=0, sticky=tk.W, pady=2)
+        self.ticker_entry = ttk.Entry(form, width=12)
+        self.ticker_entry.grid(row=1, column=1, sticky=tk.W, pady=2)
+        ttk.Label(form, text="Razmerje (novo:staro):").grid(row=1, column=2, sticky=tk.W, padx=(10, 0), pady=2)
+        self.ratio_entry = ttk.Entry(form, width=12)
+        self.ratio_entry.grid(row=1, column=3, sticky=tk.W, pady=2)
+        ttk.Label(form, text="Novi ticker:").grid(row=2, column=2, sticky=tk.W, padx=(10, 0), pady=2)
+        self.new_ticker_entry = ttk.Entry(form, width=12)
+        self.new_ticker_entry.grid(row=2, column=3, sticky=tk.W, pady=2)
+        ttk.Button(form, text="Dodaj", command=self.add_action).grid(row=0, column=4, padx=(10, 0))
+        ttk.Button(form, text="Zbriši izbrano", command=self.delete_action).grid(row=1, column=4, padx=(10, 0))
+
+        columns = ("date", "action")
+        self.tree = ttk.Treeview(self, columns=columns, show="headings")
+        self.tree.heading("date", text="Datum")
+        self.tree.heading("action", text="Dogodek")
+        self.tree.column("date", width=100, anchor=tk.W)
+        self.tree.column("action", width=400, anchor=tk.W)
+        self.tree.pack(fill=tk.BOTH, expand=True, padx=5, pady=(0, 5))
+        self.refresh()
+
+    def refresh(self):
+        self.tree.delete(*self.tree.get_children())
+        for action in self.app.accounts.actions:
+            self.tree.insert("", tk.END, iid=action.id, values=(action.date, action.description))
+
+    def add_action(self):
+        if self.app.engine_busy():
+            messagebox.showerror("Napaka", "Počakajte, da se izračun v ozadju konča.", parent=self)
+            return
+        kind = self.KINDS[self.kind_combo.get()]
+        ticker = self.ticker_entry.get().strip().upper()
+        try:
+            ordinal = date_ordinal(self.date_entry.get().strip())
+        except ValueError:
+            messagebox.showerror("Napaka pri vnosu", "Neveljaven format datuma. Uporabite DD.MM.YYYY.", parent=self)
+            return
+        if not ticker:
+            messagebox.showerror("Napaka pri vnosu", "Ticker ne sme biti prazen.", parent=self)
+            return
+        try:
+            if kind == SPLIT:
+                action = CorporateAction(new_action_id(), ordinal, kind, ticker,
+                                         ratio=parse_ratio(self.ratio_entry.get()))
+            else:
+                action = CorporateAction(new_action_id(), ordinal, kind, ticker,
+                                         new_ticker=self.new_ticker_entry.get().strip().upper())
+        except ValueError as e:
+            messagebox.showerror("Napaka pri vnosu", str(e), parent=self)
+            return
+        self.app.set_actions(self.app.accounts.actions.with_action(action))
+
+    def delete_action(self):
+        selected = self.tree.selection()
+        if not selected:
+            return
+        if self.app.engine_busy():
+            messagebox.showerror("Napaka", "Počakajte, da se izračun v ozadju konča.", parent=self)
+            return
+        actions = self.app.accounts.actions
+        for action_id in selected:
+            actions = actions.without(action_id)
+        self.app.set_actions(actions)
+
 
 class SloTaxApp:
     """
@@ -21,12 +451,46 @@ class SloTaxApp:
         self.root.title("SloTax ETF Manager")
         self.root.geometry("1200x600")
 
-        # Data storage
-        self.transactions = []
-        self.portfolio_file = "portfolio.json"
+        # Splits and ticker changes, applied by FIFO while matching
+        self.actions_file = ACTIONS_FILE
+        try:
+            actions = read_actions(self.actions_file)
+            startup_error = None
+        except (ValueError, KeyError, TypeError, OSError):
+            actions = CorporateActions()
+            startup_error = f"Napaka: korporacijskih dogodkov '{self.actions_file}' ni mogoče prebrati."
+        # Data storage: every account (broker) is a portfolio file of its own
+        self.accounts_file = ACCOUNTS_FILE
+        try:
+            self.accounts = read_accounts(self.accounts_file, actions)
+        except (ValueError, KeyError, TypeError, OSError):
+            self.accounts = AccountSet([Account(*DEFAULT_ACCOUNT)], actions)
+            startup_error = f"Napaka: seznama računov '{self.accounts_file}' ni mogoče prebrati; naložen je le glavni račun."
+        self.transactions = self.accounts.transactions  # Transaction id -> transaction, all accounts
+        # Reference exchange rates for non-EUR transactions, imported once
+        self.rates_file = "fxrates.bin"
+        try:
+            self.rates = RateStore(self.rates_file)
+        except (ValueError, OSError):
+            self.rates = None  # Damaged; importing the rates again replaces it
+        # FIFO ledgers over all accounts, updated incrementally as transactions are added or deleted
+        self.engine = self.accounts.engine
+        # Display order of the transaction table
+        self.rows = SortedRows()
+        # Long-running operations run on worker threads; results come back via root.after
+        self.jobs = JobRunner(self.root.after)
+        self.jobs.on_change = self._show_jobs
+        self._locks = Counter()
+        self.loading = False
+        self.diagnostics_window = None
+        self.simulator_window = None
+        self.actions_window = None
 
         self.create_widgets()
         self.load_transactions()
+        if startup_error:
+            self.update_status(startup_error, is_error=True)
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 
     def create_widgets(self):
         # Main frame
@@ -55,27 +519,70 @@ class SloTaxApp:
         self.quantity_entry = ttk.Entry(left_panel)
         self.quantity_entry.grid(row=3, column=1, pady=2)
 
-        ttk.Label(left_panel, text="Cena na enoto (€):").grid(row=4, column=0, sticky=tk.W, pady=2)
+        ttk.Label(left_panel, text="Cena na enoto:").grid(row=4, column=0, sticky=tk.W, pady=2)
         self.price_entry = ttk.Entry(left_panel)
         self.price_entry.grid(row=4, column=1, pady=2)
         
-        ttk.Label(left_panel, text="Stroški (€):").grid(row=5, column=0, sticky=tk.W, pady=2)
+        ttk.Label(left_panel, text="Stroški:").grid(row=5, column=0, sticky=tk.W, pady=2)
         self.costs_entry = ttk.Entry(left_panel)
         self.costs_entry.grid(row=5, column=1, pady=2)
         self.costs_entry.insert(0, "0.0")
 
-        add_button = ttk.Button(left_panel, text="Dodaj Transakcijo", command=self.add_transaction)
-        add_button.grid(row=6, columnspan=2, pady=20, sticky="ew")
+        # Price and costs are entered in this currency; the XML export converts them to EUR
+        ttk.Label(left_panel, text="Valuta:").grid(row=6, column=0, sticky=tk.W, pady=2)
+        currencies = sorted({EUR, "USD", "GBP", "CHF"} | set(self.rates.currencies if self.rates else ()))
+        self.currency_combo = ttk.Combobox(left_panel, values=currencies, state="readonly")
+        self.currency_combo.grid(row=6, column=1, pady=2)
+        self.currency_combo.set(EUR)
+
+        # New transactions are saved to this account; FIFO runs over all accounts together
+        ttk.Label(left_panel, text="Račun:").grid(row=7, column=0, sticky=tk.W, pady=2)
+        self.account_combo = ttk.Combobox(left_panel, values=self._account_names(), state="readonly")
+        self.account_combo.grid(row=7, column=1, pady=2)
+        self.account_combo.set(self.accounts.primary.name)
+
+        self.add_button = ttk.Button(left_panel, text="Dodaj Transakcijo", command=self.add_transaction)
+        self.add_button.grid(row=8, columnspan=2, pady=20, sticky="ew")
+
+        self.add_account_button = ttk.Button(left_panel, text="Dodaj račun", command=self.add_account)
+        self.add_account_button.grid(row=9, columnspan=2, pady=2, sticky="ew")
+        self.remove_account_button = ttk.Button(left_panel, text="Odstrani račun", command=self.remove_account)
+        self.remove_account_button.grid(row=10, columnspan=2, pady=2, sticky="ew")
 
         # --- Right Panel (View) ---
         right_panel = ttk.Frame(main_frame)
         right_panel.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        # Filter bar; the table narrows with every keystroke
+        filter_frame = ttk.Frame(right_panel)
+        filter_frame.pack(fill=tk.X, pady=(0, 5))
+        self.filter_vars = {name: tk.StringVar() for name in ("ticker", "type", "start", "end", "min_value", "max_value")}
+        self.filter_vars["type"].set("Vse")
+        ttk.Label(filter_frame, text="Ticker:").pack(side=tk.LEFT)
+        ttk.Entry(filter_frame, textvariable=self.filter_vars["ticker"], width=10).pack(side=tk.LEFT, padx=(2, 8))
+        ttk.Label(filter_frame, text="Tip:").pack(side=tk.LEFT)
+        ttk.Combobox(filter_frame, textvariable=self.filter_vars["type"], values=["Vse", "Nakup", "Prodaja"],
+                     state="readonly", width=8).pack(side=tk.LEFT, padx=(2, 8))
+        ttk.Label(filter_frame, text="Datum od:").pack(side=tk.LEFT)
+        ttk.Entry(filter_frame, textvariable=self.filter_vars["start"], width=11).pack(side=tk.LEFT, padx=2)
+        ttk.Label(filter_frame, text="do:").pack(side=tk.LEFT)
+        ttk.Entry(filter_frame, textvariable=self.filter_vars["end"], width=11).pack(side=tk.LEFT, padx=(2, 8))
+        ttk.Label(filter_frame, text="Vrednost od:").pack(side=tk.LEFT)
+        ttk.Entry(filter_frame, textvariable=self.filter_vars["min_value"], width=9).pack(side=tk.LEFT, padx=2)
+        ttk.Label(filter_frame, text="do:").pack(side=tk.LEFT)
+        ttk.Entry(filter_frame, textvariable=self.filter_vars["max_value"], width=9).pack(side=tk.LEFT, padx=(2, 8))
+        ttk.Button(filter_frame, text="Počisti", command=self.clear_filter).pack(side=tk.LEFT)
+        self._clearing_filter = False
+        for var in self.filter_vars.values():
+            var.trace_add("write", lambda *args: self._clearing_filter or self.apply_filter())
         
         tree_frame = ttk.Frame(right_panel)
         tree_frame.pack(fill=tk.BOTH, expand=True)
 
-        columns = ("date", "type", "ticker", "quantity", "price", "costs", "total_value")
-        self.tree = ttk.Treeview(tree_frame, columns=columns, show="headings")
+        columns = ("date", "type", "ticker", "quantity", "price", "costs", "total_value", "account")
+        self.table = VirtualTreeview(tree_frame, self.rows, columns, self._format_row)
+        self.table.pack(fill=tk.BOTH, expand=True)
+        self.tree = self.table.tree
         
         self.tree.heading("date", text="Datum")
         self.tree.heading("type", text="Tip")
@@ -84,6 +591,7 @@ class SloTaxApp:
         self.tree.heading("price", text="Cena/enoto")
         self.tree.heading("costs", text="Stroški")
         self.tree.heading("total_value", text="Skupna Vrednost (€)")
+        self.tree.heading("account", text="Račun")
 
         self.tree.column("date", width=100, anchor=tk.W)
         self.tree.column("type", width=80, anchor=tk.W)
@@ -92,15 +600,10 @@ class SloTaxApp:
         self.tree.column("price", width=100, anchor=tk.E)
         self.tree.column("costs", width=80, anchor=tk.E)
         self.tree.column("total_value", width=150, anchor=tk.E)
-        
-        # Scrollbar
-        scrollbar = ttk.Scrollbar(tree_frame, orient=tk.VERTICAL, command=self.tree.yview)
-        self.tree.configure(yscroll=scrollbar.set)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.tree.column("account", width=120, anchor=tk.W)
 
-        delete_button = ttk.Button(right_panel, text="Zbriši Izbrano", command=self.delete_transaction)
-        delete_button.pack(pady=5, fill=tk.X)
+        self.delete_button = ttk.Button(right_panel, text="Zbriši Izbrano", command=self.delete_transaction)
+        self.delete_button.pack(pady=5, fill=tk.X)
 
         # --- Bottom Panel (Actions & Status Bar) ---
         bottom_frame = ttk.Frame(self.root)
@@ -109,72 +612,362 @@ class SloTaxApp:
         action_panel = ttk.Frame(bottom_frame)
         action_panel.pack(side=tk.TOP, fill=tk.X, expand=True)
 
-        export_csv_button = ttk.Button(action_panel, text="Izvozi CSV", command=self.export_to_csv)
-        export_csv_button.pack(side=tk.LEFT, padx=5)
+        self.import_button = ttk.Button(action_panel, text="Uvozi Trade Republic", command=self.import_statement)
+        self.import_button.pack(side=tk.LEFT, padx=5)
 
-        generate_xml_button = ttk.Button(action_panel, text="Ustvari XML za eDavke", command=self.generate_edavki_xml)
-        generate_xml_button.pack(side=tk.LEFT, padx=5)
+        self.import_rates_button = ttk.Button(action_panel, text="Uvozi tečaje", command=self.import_rates)
+        self.import_rates_button.pack(side=tk.LEFT, padx=5)
+
+        self.export_csv_button = ttk.Button(action_panel, text="Izvozi CSV", command=self.export_to_csv)
+        self.export_csv_button.pack(side=tk.LEFT, padx=5)
+
+        # Tax year of the report; defaults to the previous year
+        ttk.Label(action_panel, text="Leto:").pack(side=tk.LEFT, padx=(15, 2))
+        this_year = datetime.now().year
+        self.year_spinbox = ttk.Spinbox(action_panel, from_=2000, to=this_year, width=6)
+        self.year_spinbox.set(this_year - 1)
+        self.year_spinbox.pack(side=tk.LEFT)
+
+        self.generate_xml_button = ttk.Button(action_panel, text="Ustvari XML za eDavke", command=self.generate_edavki_xml)
+        self.generate_xml_button.pack(side=tk.LEFT, padx=5)
+
+        self.check_button = ttk.Button(action_panel, text="Preveri portfelj", command=self.check_portfolio)
+        self.check_button.pack(side=tk.LEFT, padx=5)
+
+        self.cancel_button = ttk.Button(action_panel, text="Prekliči", command=self.jobs.cancel_all, state=tk.DISABLED)
+        self.cancel_button.pack(side=tk.RIGHT, padx=5)
+
+        ttk.Button(action_panel, text="Diagnostika", command=self.show_diagnostics).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(action_panel, text="Simulacija prodaje", command=self.show_simulator).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(action_panel, text="Korporacijski dogodki", command=self.show_actions).pack(side=tk.RIGHT, padx=5)
+
+        # Buttons whose actions read or change the FIFO engine
+        self.engine_buttons = (self.add_button, self.delete_button, self.import_button, self.generate_xml_button,
+                               self.check_button, self.add_account_button, self.remove_account_button)
 
         self.status_bar = tk.Label(bottom_frame, text="Pripravljen.", bd=1, relief=tk.SUNKEN, anchor=tk.W)
         self.status_bar.pack(side=tk.BOTTOM, fill=tk.X, expand=True, ipady=2)
 
+    def show_diagnostics(self):
+        if self.diagnostics_window is not None and self.diagnostics_window.winfo_exists():
+            self.diagnostics_window.lift()
+            return
+        self.diagnostics_window = DiagnosticsWindow(self.root)
+
+    def show_simulator(self):
+        if self.simulator_window is not None and self.simulator_window.winfo_exists():
+            self.simulator_window.ticker_combo.config(values=sorted(self.engine.ledgers))
+            self.simulator_window.lift()
+            return
+        self.simulator_window = SaleSimulatorWindow(self)
+
+    def show_actions(self):
+        if self.actions_window is not None and self.actions_window.winfo_exists():
+            self.actions_window.lift()
+            return
+        self.actions_window = CorporateActionsWindow(self)
+
+    def set_actions(self, actions):
+        """
+        Saves the corporate actions and rebuilds the FIFO ledgers with them
+        on a worker thread. The transactions themselves are not changed.
+        """
+        try:
+            write_actions(actions, self.actions_file)
+        except IOError:
+            messagebox.showerror("Napaka pri shranjevanju", f"Datoteke '{self.actions_file}' ni mogoče zapisati.")
+            return
+
+        def applied(result):
+            self.engine = self.accounts.engine
+            if self.actions_window is not None and self.actions_window.winfo_exists():
+                self.actions_window.refresh()
+            if self.simulator_window is not None and self.simulator_window.winfo_exists():
+                self.simulator_window.ticker_combo.config(values=sorted(self.engine.ledgers))
+            self.update_status(f"Korporacijski dogodki shranjeni ({len(actions)}), FIFO preračunan.")
+
+        self.run_job("Uporabljam korporacijske dogodke", lambda job: self.accounts.set_actions(actions),
+                     on_done=applied, locks=self.engine_buttons, cancellable=False)
+
+    def engine_busy(self):
+        """Whether a job is using the FIFO engine on a worker thread right now."""
+        # Every job that reads or rebuilds the engine locks the XML button
+        return bool(self._locks[self.generate_xml_button])
+
     def update_status(self, message, is_error=False):
         self.status_bar.config(text=message, fg="red" if is_error else "black")
 
+    def run_job(self, name, fn, *args, on_done=None, on_error=None, locks=(), cancellable=True):
+        """
+        Runs fn(*args, job) on a worker thread. The buttons in locks are
+        disabled until the job ends; the callbacks run on the Tk thread.
+        """
+        for button in locks:
+            self._locks[button] += 1
+            button.config(state=tk.DISABLED)
+
+        def unlocking(callback):
+            def wrapper(*args):
+                for button in locks:
+                    self._locks[button] -= 1
+                    if not self._locks[button]:
+                        button.config(state=tk.NORMAL)
+                if callback is not None:
+                    callback(*args)
+            return wrapper
+
+        self.jobs.submit(
+            name, fn, *args,
+            on_done=unlocking(on_done),
+            on_error=unlocking(on_error or self._job_failed),
+            on_cancel=unlocking(lambda: self.update_status(f"{name}: preklicano.")),
+            cancellable=cancellable
+        )
+        self._show_jobs()
+
+    def _show_jobs(self):
+        """Shows the progress of the running jobs in the status bar."""
+        if not self.jobs.running:
+            self.cancel_button.config(state=tk.DISABLED)
+            return
+        self.update_status(", ".join(f"{job.name}... {job.fraction:.0%}" for job in self.jobs.running))
+        cancellable = any(job.cancellable for job in self.jobs.running)
+        self.cancel_button.config(state=tk.NORMAL if cancellable else tk.DISABLED)
+
+    def _job_failed(self, error):
+        messagebox.showerror("Napaka", str(error))
+        self.update_status(f"Napaka: {error}", is_error=True)
+
     def load_transactions(self):
         """
-        Loads transactions from the portfolio.json file upon startup.
-        If the file doesn't exist, it does nothing and waits for new transactions.
-        If the file is corrupted, it shows an error.
+        Loads transactions from the portfolio file of every account upon
+        startup and replays the changes journaled since each was last written.
+        If no file exists, it does nothing and waits for new transactions.
+        If a file is corrupted, it shows an error.
+        The files are read and indexed on a worker thread; the window stays
+        responsive and editing is locked until loading finishes.
         """
-        if not os.path.exists(self.portfolio_file):
-            self.update_status(f"Datoteka '{self.portfolio_file}' ne obstaja. Ustvarjena bo ob prvem shranjevanju.")
+        primary = self.accounts.primary
+        if not self.accounts.exists():
+            self.update_status(f"Datoteka '{primary.path}' ne obstaja. Ustvarjena bo ob prvem shranjevanju.")
             return
 
-        try:
-            with open(self.portfolio_file, 'r', encoding='utf-8') as f:
-                self.transactions = json.load(f)
-            self.populate_treeview()
-            self.update_status(f"Transakcije uspešno naložene iz '{self.portfolio_file}'.")
-        except (json.JSONDecodeError, FileNotFoundError):
-            messagebox.showerror("Napaka pri nalaganju", f"Datoteko '{self.portfolio_file}' je poškodovana ali je ni mogoče prebrati.")
+        def load(job):
+            accounts = AccountSet(self.accounts.accounts, self.accounts.actions)
+            accounts.load()
+            # Year-end lots saved last time spare recomputing earlier years
+            accounts.engine.restore_checkpoints(primary.store.load_checkpoints())
+            job.progress(0.7)
+            rows = SortedRows()
+            rows.load(accounts.transactions.values())
+            return accounts, rows
+
+        def loaded(result):
+            self.loading = False
+            self.accounts, self.rows = result
+            self.transactions = self.accounts.transactions
+            self.engine = self.accounts.engine
+            self.table.rows = self.rows
+            self.rows.set_filter(self.read_filter())
+            self.populate_treeview(reload=False)
+            if len(self.accounts.accounts) > 1:
+                self.update_status(f"Transakcije uspešno naložene iz {len(self.accounts.accounts)} računov.")
+            else:
+                self.update_status(f"Transakcije uspešno naložene iz '{primary.path}'.")
+
+        def failed(error):
+            self.loading = False
+            if not isinstance(error, (json.JSONDecodeError, FileNotFoundError)):
+                return self._job_failed(error)
+            paths = ", ".join(f"'{account.path}'" for account in self.accounts.accounts)
+            messagebox.showerror("Napaka pri nalaganju", f"Datoteka portfelja ({paths}) je poškodovana ali je ni mogoče prebrati.")
             self.update_status("Napaka pri nalaganju transakcij.", is_error=True)
 
-    def save_transactions(self):
+        # Not cancellable: a half-loaded portfolio must never be saved over the real one
+        self.loading = True
+        all_buttons = self.engine_buttons + (self.export_csv_button,)
+        self.run_job("Nalagam transakcije", load, on_done=loaded, on_error=failed,
+                     locks=all_buttons, cancellable=False)
+
+    def save_transactions(self, account, added=(), deleted=()):
         """
-        Saves the current list of transactions to the portfolio.json file.
-        This function is called every time a transaction is added or deleted,
-        ensuring data persistence. The JSON format is human-readable and easy
-        to back up. Data is saved with an indent for better readability.
+        Saves the added and deleted transactions to the journal next to the
+        account's portfolio file. This function is called every time a
+        transaction is added or deleted, ensuring data persistence. Only the
+        change itself is written, so saving stays fast as the history grows;
+        the journal is folded back into the human-readable portfolio file
+        periodically and when the application closes.
         """
         try:
-            with open(self.portfolio_file, 'w', encoding='utf-8') as f:
-                json.dump(self.transactions, f, indent=4, ensure_ascii=False)
+            account.store.append(added, deleted)
+            if account.store.needs_compaction():
+                account.store.compact(account.transactions)
             self.update_status("Transakcije shranjene.")
         except IOError:
-            messagebox.showerror("Napaka pri shranjevanju", f"Datoteke '{self.portfolio_file}' ni mogoče zapisati.")
+            messagebox.showerror("Napaka pri shranjevanju", f"Datoteke '{account.path}' ni mogoče zapisati.")
             self.update_status("Napaka pri shranjevanju transakcij.", is_error=True)
 
-    def populate_treeview(self):
-        # Clear existing items
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-        
-        # Sort by date before populating
-        sorted_transactions = sorted(self.transactions, key=lambda x: datetime.strptime(x['date'], "%d.%m.%Y"))
-        
-        # Add new items
-        for tx in sorted_transactions:
-            total_value = tx['quantity'] * tx['price']
-            self.tree.insert("", tk.END, values=(
-                tx['date'],
-                tx['type'],
-                tx['ticker'],
-                f"{tx['quantity']:.4f}",
-                f"{tx['price']:.4f}",
-                f"{tx['costs']:.4f}",
-                f"{total_value:.2f}"
-            ))
+    def on_close(self):
+        """
+        Folds the journals into the portfolio files and saves the year-end
+        FIFO checkpoints before the window closes.
+        """
+        # Wait for cancelled jobs to stop, so none is still using the engine
+        self.jobs.shutdown(wait=True)
+        if self.rates is not None:
+            self.rates.close()
+        if not self.loading:
+            for account in self.accounts.accounts:
+                if account.store.pending:
+                    try:
+                        account.store.compact(account.transactions)
+                    except IOError:
+                        messagebox.showerror("Napaka pri shranjevanju", f"Datoteke '{account.path}' ni mogoče zapisati.")
+            try:
+                # The checkpoints cover all accounts; their fingerprints reject them if the accounts change
+                self.accounts.primary.store.save_checkpoints(self.engine.export_checkpoints())
+            except IOError:
+                pass  # Only a cache; the lots are recomputed next time
+        self.accounts.close()
+        self.root.destroy()
+
+    def populate_treeview(self, reload=True):
+        """
+        Rebuilds the table model from scratch. Only used after loading;
+        adds and deletes update the model row by row.
+        """
+        if reload:
+            self.rows.load(self.transactions.values())
+        self.table.selected.clear()
+        self.table.top = 0
+        self.table.refresh()
+
+    def _format_row(self, tx):
+        return format_row(tx) + (self.accounts.account_of(tx).name,)
+
+    def _account_names(self):
+        return [account.name for account in self.accounts.accounts]
+
+    def add_account(self):
+        """
+        Registers another portfolio file as an account, e.g. for a second
+        broker. An existing file is loaded; a new name starts an empty
+        account. FIFO then runs over the union of all accounts, and only the
+        tickers the new account trades are recomputed.
+        """
+        filename = filedialog.asksaveasfilename(
+            defaultextension=".json",
+            filetypes=[("Portfelj", "*.json"), ("Vse datoteke", "*.*")],
+            title="Dodaj račun (obstoječ ali nov portfelj)",
+            confirmoverwrite=False
+        )
+        if not filename:
+            return
+        account = Account(os.path.splitext(os.path.basename(filename))[0], filename)
+        try:
+            self.accounts.prepare(account)
+        except ValueError as e:
+            messagebox.showerror("Napaka pri dodajanju računa", str(e))
+            self.update_status("Računa ni bilo mogoče dodati.", is_error=True)
+            return
+
+        def added(_):
+            # On the Tk thread: the table reads the shared AccountSet while it draws
+            try:
+                tickers = self.accounts.attach(account)
+            except ValueError as e:
+                account.store.close()
+                return failed(e)
+            try:
+                write_accounts(self.accounts, self.accounts_file)
+            except IOError:
+                messagebox.showerror("Napaka pri shranjevanju", f"Datoteke '{self.accounts_file}' ni mogoče zapisati.")
+            self.account_combo.config(values=self._account_names())
+            self.account_combo.set(account.name)
+            self.populate_treeview()
+            self.update_status(f"Račun '{account.name}' dodan: {len(account.transactions)} transakcij, "
+                               f"{len(tickers)} tickerjev preračunanih.")
+
+        def failed(error):
+            if not isinstance(error, (ValueError, IOError)):
+                return self._job_failed(error)
+            messagebox.showerror("Napaka pri dodajanju računa", str(error))
+            self.update_status("Računa ni bilo mogoče dodati.", is_error=True)
+
+        # Only reading the file runs on the worker
+        self.run_job("Dodajam račun", lambda job: account.load(), on_done=added,
+                     on_error=failed, locks=self.engine_buttons + (self.export_csv_button,), cancellable=False)
+
+    def remove_account(self):
+        """
+        Stops using the account chosen under "Račun". Its file is left as it
+        is and can be added again later.
+        """
+        account = self.accounts.get(self.account_combo.get())
+        if account is self.accounts.primary:
+            self.update_status("Napaka: Glavnega računa ni mogoče odstraniti.", is_error=True)
+            return
+        if not messagebox.askyesno(
+                "Odstrani račun",
+                f"Odstranim račun '{account.name}'? Datoteka '{account.path}' ostane nespremenjena, "
+                f"njene transakcije pa ne bodo več upoštevane pri FIFO."):
+            return
+        if account.store.pending:
+            try:
+                account.store.compact(account.transactions)
+            except IOError:
+                pass  # The journal stays next to the file and is replayed when it is loaded again
+        self.accounts.remove_account(account)
+        try:
+            write_accounts(self.accounts, self.accounts_file)
+        except IOError:
+            messagebox.showerror("Napaka pri shranjevanju", f"Datoteke '{self.accounts_file}' ni mogoče zapisati.")
+        self.account_combo.config(values=self._account_names())
+        self.account_combo.set(self.accounts.primary.name)
+        self.populate_treeview()
+        self.update_status(f"Račun '{account.name}' odstranjen.")
+
+    def read_filter(self):
+        """
+        Returns the RowFilter of the filter bar. Fields that are empty or not
+        (yet) valid, such as a half-typed date, are left out.
+        """
+        def parse(name, convert):
+            text = self.filter_vars[name].get().strip()
+            try:
+                return convert(text) if text else None
+            except ValueError:
+                return None
+
+        type_label = self.filter_vars["type"].get()
+        return RowFilter(
+            ticker=self.filter_vars["ticker"].get().strip().upper() or None,
+            type=TxType.from_label(type_label) if type_label in ("Nakup", "Prodaja") else None,
+            start=parse("start", date_ordinal),
+            end=parse("end", date_ordinal),
+            min_value=parse("min_value", lambda text: float(text.replace(',', '.'))),
+            max_value=parse("max_value", lambda text: float(text.replace(',', '.')))
+        )
+
+    def apply_filter(self):
+        shown = self.rows.set_filter(self.read_filter())
+        # Hidden rows must not stay selected, or deleting would remove rows the user can't see
+        self.table.selected.clear()
+        self.table.top = 0
+        self.table.refresh()
+        if self.rows.filter is not None:
+            self.update_status(f"Prikazanih {shown} od {self.rows.total} transakcij.")
+        else:
+            self.update_status("Prikazane so vse transakcije.")
+
+    def clear_filter(self):
+        self._clearing_filter = True
+        try:
+            for name, var in self.filter_vars.items():
+                var.set("Vse" if name == "type" else "")
+        finally:
+            self._clearing_filter = False
+        self.apply_filter()
 
     def add_transaction(self):
         # --- 1. Get and Validate Inputs ---
@@ -200,20 +993,39 @@ class SloTaxApp:
             self.update_status("Napaka: Količina, cena in stroški morajo biti številske vrednosti.", is_error=True)
             return
 
-        # --- 2. Create Transaction Dictionary ---
-        new_tx = {
+        # --- 2. Create Transaction Record ---
+        new_tx = Transaction.from_dict({
+            "id": new_transaction_id(),
             "date": date_str,
             "type": tx_type,
             "ticker": ticker,
             "quantity": quantity,
             "price": price,
-            "costs": costs
-        }
+            "costs": costs,
+            "currency": self.currency_combo.get()
+        })
+
+        # A sale that earlier buys can't cover is flagged right away, not at export time
+        issue = self.engine.check_add(new_tx)
+        if issue is not None and not messagebox.askyesno(
+                "Prodaja brez kritja", f"{issue.message}\nProdaja ne bo pokrita z nakupi. Vseeno dodam transakcijo?"):
+            self.update_status("Transakcija ni bila dodana.", is_error=True)
+            return
+        if new_tx.currency != EUR:
+            try:
+                if self.rates is None:
+                    raise MissingRateError(f"Za transakcije v {new_tx.currency} najprej uvozite tečajnico.")
+                self.rates.rate(new_tx.currency, new_tx.ordinal)
+            except MissingRateError as e:
+                # Allowed, but the XML export needs the rate, so say so now
+                messagebox.showwarning("Manjka tečaj", str(e))
 
         # --- 3. Update Data and UI ---
-        self.transactions.append(new_tx)
-        self.save_transactions()
-        self.populate_treeview()
+        account = self.accounts.get(self.account_combo.get())
+        self.accounts.add(account, new_tx)
+        self.save_transactions(account, added=[new_tx])
+        self.table.see(self.rows.insert(new_tx))
+        hidden = self.rows.index(new_tx.id) is None
 
         # --- 4. Clear Entry Fields ---
         self.ticker_entry.delete(0, tk.END)
@@ -222,50 +1034,145 @@ class SloTaxApp:
         self.costs_entry.delete(0, tk.END)
         self.costs_entry.insert(0, "0.0")
         self.ticker_entry.focus()
-        self.update_status("Transakcija uspešno dodana.")
+        if hidden:
+            self.update_status("Transakcija uspešno dodana, a je filter ne prikazuje.")
+        else:
+            self.update_status("Transakcija uspešno dodana.")
 
     def delete_transaction(self):
-        selected_items = self.tree.selection()
+        selected_items = [iid for iid in self.table.selected if iid in self.rows]
         if not selected_items:
             self.update_status("Nobena transakcija ni izbrana za brisanje.", is_error=True)
             return
 
-        if messagebox.askyesno("Potrdi Brisanje", "Ali ste prepričani, da želite zbrisati izbrane transakcije?"):
-            # We need to delete from the bottom up to not mess up indices
-            # The Treeview selection gives us item IDs, which we can map to our list
-            
-            # Create a map of treeview item values (as a tuple) to its index in the original list
-            sorted_trans = sorted(self.transactions, key=lambda x: datetime.strptime(x['date'], "%d.%m.%Y"))
-            
-            items_to_delete_indices = []
-            for item_id in selected_items:
-                item_values = self.tree.item(item_id)['values']
-                # Find this item in our sorted transaction list to find its original counterpart
-                for i, tx in enumerate(sorted_trans):
-                     total_value = tx['quantity'] * tx['price']
-                     tree_values = (
-                         tx['date'], tx['type'], tx['ticker'], f"{tx['quantity']:.4f}",
-                         f"{tx['price']:.4f}", f"{tx['costs']:.4f}", f"{total_value:.2f}"
-                     )
-                     if tuple(map(str, tree_values)) == tuple(map(str, item_values)):
-                         # Now find this tx in the original self.transactions list by object identity
-                         original_index = -1
-                         for j, original_tx in enumerate(self.transactions):
-                             if original_tx is tx:
-                                 original_index = j
-                                 break
-                         if original_index != -1:
-                            items_to_delete_indices.append(original_index)
-                         break
-
-            # Delete from the original list using indices, sorted descending to avoid index shifting issues
-            for index in sorted(items_to_delete_indices, reverse=True):
-                del self.transactions[index]
-
-            self.save_transactions()
-            self.populate_treeview()
+        question = "Ali ste prepričani, da želite zbrisati izbrane transakcije?"
+        issues = self.engine.check_remove([self.rows[iid] for iid in selected_items])
+        if issues:
+            question = ("\n".join(issue.message for issue in issues[:10])
+                        + "\nNekatere prodaje ne bodo več pokrite z nakupi. " + question)
+
+        if messagebox.askyesno("Potrdi Brisanje", question):
+            # Table rows are keyed by transaction id, so every selected row maps
+            # to exactly one transaction, even if two trades look the same
+            deleted = self.rows.remove_many(selected_items)
+            by_account = {}
+            for tx in deleted:
+                by_account.setdefault(self.accounts.remove(tx), []).append(tx)
+
+            for account, account_deleted in by_account.items():
+                self.save_transactions(account, deleted=account_deleted)
+            self.table.discard(selected_items)
+            self.table.refresh()
             self.update_status("Izbrane transakcije so bile zbrisane.")
 
+    def import_rates(self):
+        """
+        Imports a historical reference rate table (ECB eurofxref-hist CSV or
+        XML, or a Banka Slovenije tečajnica XML) into fxrates.bin. Rates
+        already in the store are kept, so newer tables can be added later.
+        """
+        filename = filedialog.askopenfilename(
+            filetypes=[("Tečajnica", "*.csv *.xml"), ("Vse datoteke", "*.*")],
+            title="Uvozi tečajnico ECB ali Banke Slovenije"
+        )
+        if not filename:
+            return
+
+        def run(job):
+            rates = self.rates
+            if rates is None:
+                # The old file could not be read; start over
+                if os.path.exists(self.rates_file):
+                    os.remove(self.rates_file)
+                rates = RateStore(self.rates_file)
+            # Only the new file is written here; adding a transaction looks rates up meanwhile
+            return rates, rates.stage_import(filename)
+
+        def imported(result):
+            rates, count = result
+            # On the Tk thread, where the lookups are made; the same store stays shared with the simulator
+            try:
+                rates.commit_import()
+            except OSError as e:
+                return failed(e)
+            self.rates = rates
+            first, last = self.rates.date_range
+            values = sorted(set(self.currency_combo.cget("values")) | set(self.rates.currencies))
+            self.currency_combo.config(values=values)
+            self.update_status(f"Uvoženih {count} tečajev, na voljo od {format_date(first)} do {format_date(last)}.")
+
+        def failed(error):
+            if not isinstance(error, (ValueError, IOError, SyntaxError)):
+                return self._job_failed(error)
+            messagebox.showerror("Napaka pri uvozu tečajev", str(error))
+            self.update_status("Napaka pri uvozu tečajev.", is_error=True)
+
+        # The XML export and the simulator read the rates, so they wait for the new file
+        self.run_job("Uvažam tečaje", run, on_done=imported, on_error=failed,
+                     locks=(self.import_rates_button, self.generate_xml_button), cancellable=False)
+
+    def import_statement(self):
+        """
+        Imports a Trade Republic CSV export or PDF statement. The file is
+        parsed on a background thread; the new transactions are then added
+        in one batch: one journal write, one table update.
+        """
+        filename = filedialog.askopenfilename(
+            filetypes=[("Trade Republic izvoz", "*.csv *.pdf"), ("Vse datoteke", "*.*")],
+            title="Uvozi Trade Republic izvoz"
+        )
+        if not filename:
+            return
+
+        def failed(error):
+            if not isinstance(error, (ImportFormatError, IOError)):
+                return self._job_failed(error)
+            messagebox.showerror("Napaka pri uvozu", str(error))
+            self.update_status("Napaka pri uvozu.", is_error=True)
+
+        # Duplicates are looked for in the receiving account only; other brokers' trades are separate
+        account = self.accounts.get(self.account_combo.get())
+        existing = list(account.transactions.values())
+        # The batch is committed to the engine when the job ends, so no export may run meanwhile, and
+        # edits wait too: existing is already taken for the duplicate check
+        self.run_job("Uvažam", lambda job: import_file(filename, existing, job.progress),
+                     on_done=lambda result: self._commit_import(result, filename, account), on_error=failed,
+                     locks=self.engine_buttons + (self.export_csv_button,))
+
+    def _commit_import(self, result, filename, account):
+        if len(result.added) > 1000:
+            # Rebuilding the touched tickers once is cheaper than thousands of sorted inserts
+            self.accounts.add_many(account, result.added)
+            self.populate_treeview()
+        else:
+            for tx in result.added:
+                self.accounts.add(account, tx)
+                self.rows.insert(tx)
+            self.table.refresh()
+
+        status = (f"Iz '{filename}' uvoženih {len(result.added)} transakcij "
+                  f"({result.duplicates} že obstoječih, {result.skipped} preskočenih vrstic).")
+        if not result.added:
+            self.update_status(status)
+            return
+
+        # A large batch fills the journal, and folding it into the snapshot rewrites the whole
+        # file, so it is saved on a worker, from a copy of the account, with editing locked
+        snapshot = dict(account.transactions)
+
+        def save(job):
+            account.store.append(result.added)
+            if account.store.needs_compaction():
+                account.store.compact(snapshot)
+
+        def failed(error):
+            if not isinstance(error, IOError):
+                return self._job_failed(error)
+            messagebox.showerror("Napaka pri shranjevanju", f"Datoteke '{account.path}' ni mogoče zapisati.")
+            self.update_status("Napaka pri shranjevanju transakcij.", is_error=True)
+
+        self.run_job("Shranjujem", save, on_done=lambda _: self.update_status(status), on_error=failed,
+                     locks=self.engine_buttons + (self.export_csv_button,), cancellable=False)
 
     def export_to_csv(self):
         if not self.transactions:
@@ -279,172 +1186,103 @@ class SloTaxApp:
         )
         if not filename:
             return
-            
-        try:
-            with open(filename, 'w', newline='', encoding='utf-8') as f:
-                writer = csv.DictWriter(f, fieldnames=self.transactions[0].keys())
-                writer.writeheader()
-                writer.writerows(self.transactions)
-            self.update_status(f"Podatki uspešno izvoženi v '{filename}'.")
-        except IOError:
+
+        def failed(error):
+            if not isinstance(error, IOError):
+                return self._job_failed(error)
             messagebox.showerror("Napaka pri izvozu", f"Datoteke '{filename}' ni mogoče zapisati.")
             self.update_status("Napaka pri izvozu v CSV.", is_error=True)
 
+        # A snapshot of the list is written, so editing can go on meanwhile
+        transactions = list(self.transactions.values())
+        self.run_job("Izvažam CSV", lambda job: export_csv(filename, transactions, job.progress),
+                     on_done=lambda result: self.update_status(f"Podatki uspešno izvoženi v '{filename}'."),
+                     on_error=failed, locks=(self.export_csv_button,))
+
+    def check_portfolio(self):
+        """
+        Reports every ticker whose position goes negative at some point,
+        i.e. that has sales not covered by earlier buys. One pass over the
+        running-position indexes; no FIFO matching needed.
+        """
+        def checked(issues):
+            if not issues:
+                self.update_status("Portfelj je v redu: vse prodaje so pokrite z nakupi.")
+                messagebox.showinfo("Preverjanje portfelja", "Vse prodaje so pokrite z nakupi.")
+                return
+            lines = [issue.message for issue in issues[:20]]
+            if len(issues) > 20:
+                lines.append(f"... in še {len(issues) - 20}.")
+            self.update_status(f"Prodaje brez kritja pri {len(issues)} tickerjih.", is_error=True)
+            messagebox.showwarning("Preverjanje portfelja", "\n".join(lines))
+
+        self.run_job("Preverjam portfelj", lambda job: self.engine.position_report(job.progress),
+                     on_done=checked, locks=self.engine_buttons)
+
     def generate_edavki_xml(self):
         """
         Main logic for FIFO calculation and XML generation.
+        The report covers the sales of the year chosen next to the button.
+        The FIFO matching runs in the engine on a worker thread and only
+        recomputes tickers changed since the last export, starting from the
+        lots left at the end of the previous year where they are known.
+        Uncovered sales come back as a list of issues.
         """
-        # --- 1. Group transactions by ticker ---
-        transactions_by_ticker = {}
-        for tx in self.transactions:
-            ticker = tx['ticker']
-            if ticker not in transactions_by_ticker:
-                transactions_by_ticker[ticker] = []
-            transactions_by_ticker[ticker].append(tx)
-
-        # This list will hold all the matched sale-purchase pairs for XML generation.
-        all_matched_pairs = []
-        
-        # --- 2. Process each ticker group with FIFO logic ---
-        for ticker, tx_list in transactions_by_ticker.items():
-            
-            # Sort by date to ensure correct FIFO order
-            tx_list.sort(key=lambda x: datetime.strptime(x['date'], "%d.%m.%Y"))
-
-            # Separate buys and sells. We use deepcopy to avoid modifying the original data.
-            # We add a 'remaining_quantity' key to buys to track partially used lots.
-            buys = deque()
-            for tx in tx_list:
-                if tx['type'] == 'Nakup':
-                    buy_copy = copy.deepcopy(tx)
-                    buy_copy['remaining_quantity'] = buy_copy['quantity']
-                    buys.append(buy_copy)
-            
-            sells = [tx for tx in tx_list if tx['type'] == 'Prodaja']
-
-            if not sells:
-                continue # No sales for this ticker, nothing to do.
-
-            # --- FIFO Engine Core Logic ---
-            # For each sale, find the corresponding purchase(s) on a first-in, first-out basis.
-            for sale in sells:
-                quantity_to_sell = sale['quantity']
-                
-                # Keep matching with the oldest buys until the sale quantity is fully covered
-                while quantity_to_sell > 1e-9: # Use a small epsilon for float comparison
-                    if not buys:
-                        messagebox.showerror("Napaka v logiki", f"Ni dovolj nakupov za kritje prodaje {sale['quantity']} enot {ticker} na dan {sale['date']}.")
-                        self.update_status("Napaka: Prodaja brez ustreznega nakupa.", is_error=True)
-                        return
-                    
-                    oldest_buy = buys[0]
-                    
-                    # Determine the amount to match in this iteration
-                    match_quantity = min(quantity_to_sell, oldest_buy['remaining_quantity'])
-                    
-                    # Store the matched pair (sale, buy, matched_quantity) for XML generation
-                    all_matched_pairs.append({
-                        "sale": sale,
-                        "buy": oldest_buy,
-                        "quantity": match_quantity
-                    })
-                    
-                    # Update remaining quantities
-                    oldest_buy['remaining_quantity'] -= match_quantity
-                    quantity_to_sell -= match_quantity
-
-                    # If the oldest buy is fully used up, remove it from the deque
-                    if oldest_buy['remaining_quantity'] < 1e-9:
-                        buys.popleft()
-
-        if not all_matched_pairs:
-            self.update_status("Ni prodaj za poročanje v tekočem letu.", is_error=False)
-            messagebox.showinfo("Info", "Ni relevantnih prodaj za izvoz v XML.")
-            return
-
-        # --- 3. Build the XML structure ---
-        self._create_xml_file(all_matched_pairs)
-
-    def _create_xml_file(self, matched_pairs):
-        # Create root element with namespaces
-        envelope = ET.Element("Envelope", {
-            "xmlns": "http://edavki.durs.si/Documents/Schemas/Doh_KDVP_9.xsd",
-            "xmlns:edp": "http://edavki.durs.si/Documents/Schemas/Edp-Common-1.xsd"
-        })
-        body = ET.SubElement(envelope, "body")
-        doh_kdvp = ET.SubElement(body, "Doh_KDVP", {"Leto": str(datetime.now().year -1)})
-        # Assuming the tax form is for the previous year. 
-        # User should be mindful of the transaction dates they input.
-
-        # Create an item for each matched pair
-        for pair in matched_pairs:
-            sale = pair['sale']
-            buy = pair['buy']
-            qty = pair['quantity']
-
-            # Calculate values for this specific matched quantity
-            sale_price_per_unit = sale['price']
-            buy_price_per_unit = buy['price']
-
-            # Apportion costs based on the quantity being sold
-            # Sale costs are apportioned from the total sale transaction costs
-            prorated_sale_costs = (sale['costs'] / sale['quantity']) * qty if sale['quantity'] > 0 else 0
-            # Buy costs are apportioned from the total buy transaction costs
-            prorated_buy_costs = (buy['costs'] / buy['quantity']) * qty if buy['quantity'] > 0 else 0
-            
-            # Per eDavki schema:
-            # Vrednost ob pridobitvi = (Nakupna cena * Količina) + Stroški nakupa
-            # Vrednost ob odsvojitvi = (Prodajna cena * Količina) - Stroški prodaje
-            vrednost_pridobitev = (buy_price_per_unit * qty) + prorated_buy_costs
-            vrednost_odsvojitev = (sale_price_per_unit * qty) - prorated_sale_costs
+        try:
+            year = int(self.year_spinbox.get())
+        except ValueError:
+            self.update_status("Napaka: Neveljavno leto.", is_error=True)
+            return
 
-            item = ET.SubElement(doh_kdvp, "KDVP")
+        def check(job):
+            issues = self.engine.validate(job.progress, year)
+            return issues, not issues and self.engine.has_pairs(year)
 
-            # --- Section A: Podatki o zavezancu ---
-            # This section is typically filled out manually or by the eDavki system.
-            # We are focusing on the capital gains items.
-            
-            # --- Section 6: Podatki o doseženih dobičkih in izgubah... ---
-            item.set("Oznaka", "61") # Oznaka za Vrednostne papirje in deleže
-
-            # Podatki o odsvojitvi (Sale)
-            odsvojitev = ET.SubElement(item, "Odsvojitev")
-            ET.SubElement(odsvojitev, "DatumOdsvojitve").text = sale['date']
-            ET.SubElement(odsvojitev, "VrednostOdsvojitve").text = f"{vrednost_odsvojitev:.4f}"
-            ET.SubElement(odsvojitev, "SteviloEnot").text = f"{qty:.4f}"
-            
-            # Podatki o pridobitvi (Buy)
-            pridobitev = ET.SubElement(item, "Pridobitev")
-            ET.SubElement(pridobitev, "DatumPridobitve").text = buy['date']
-            ET.SubElement(pridobitev, "VrednostPridobitve").text = f"{vrednost_pridobitev:.4f}"
-            ET.SubElement(pridobitev, "NacinPridobitve").text = "A" # A = Nakup
-            ET.SubElement(pridobitev, "SteviloEnot").text = f"{qty:.4f}"
-            
-        # --- 4. Write to file ---
-        xml_str = ET.tostring(envelope, 'utf-8')
-        
-        # Pretty print
-        dom = xml.dom.minidom.parseString(xml_str)
-        pretty_xml_str = dom.toprettyxml(indent="  ", encoding="utf-8")
+        def checked(result):
+            issues, has_pairs = result
+            if issues:
+                messagebox.showerror("Napaka v logiki", "\n".join(issue.message for issue in issues))
+                self.update_status("Napaka: Prodaja brez ustreznega nakupa.", is_error=True)
+            elif not has_pairs:
+                self.update_status(f"Ni prodaj za poročanje v letu {year}.", is_error=False)
+                messagebox.showinfo("Info", "Ni relevantnih prodaj za izvoz v XML.")
+            else:
+                # --- 3. Stream the XML file ---
+                self._create_xml_file(year)
 
+        self.run_job("Računam FIFO", check, on_done=checked, locks=self.engine_buttons)
+
+    def _create_xml_file(self, year):
+        """
+        Writes the matched pairs straight to the chosen file as they are
+        produced, on a worker thread. The file is written under a temporary
+        name and moved into place, so a failed or cancelled export never
+        leaves a truncated XML behind.
+        """
         filename = filedialog.asksaveasfilename(
             defaultextension=".xml",
             filetypes=[("XML datoteke", "*.xml"), ("Vse datoteke", "*.*")],
             title="Shrani eDavki XML",
-            initialfile="Doh-KDVP.xml"
+            initialfile=f"Doh-KDVP-{year}.xml"
         )
         if not filename:
             return
 
-        try:
-            with open(filename, 'wb') as f:
-                f.write(pretty_xml_str)
+        def written(items):
             self.update_status(f"XML datoteka za eDavke uspešno ustvarjena v '{filename}'.")
             messagebox.showinfo("Uspeh", f"XML datoteka '{filename}' je bila uspešno ustvarjena.")
-        except IOError:
+
+        def failed(error):
+            if not isinstance(error, IOError):
+                return self._job_failed(error)
             messagebox.showerror("Napaka pri shranjevanju", f"Datoteke '{filename}' ni mogoče zapisati.")
             self.update_status("Napaka pri ustvarjanju XML datoteke.", is_error=True)
 
+        self.run_job("Ustvarjam XML",
+                     lambda job: write_kdvp_file(filename, self.engine.iter_matched_pairs(job.progress, year), year,
+                                                 self.rates),
+                     on_done=written, on_error=failed, locks=self.engine_buttons)
+
 if __name__ == "__main__":
     root = tk.Tk()
     app = SloTaxApp(root)
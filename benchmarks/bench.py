@@ -0,0 +1,230 @@
+"""
+Benchmarks of every pipeline stage on synthetic portfolios.
+
+    python benchmarks/bench.py                      # 1k, 100k and 1M transactions
+    python benchmarks/bench.py --sizes 1000 20000 --output before.json
+    python benchmarks/bench.py --compare before.json
+
+Each stage runs headlessly, the way the application runs it:
+
+    load          PortfolioStore.load() + FIFO engine + table rows (load_transactions)
+    save          1000 single-transaction journal appends (save_transactions)
+    compact       folding the journal into a new snapshot
+    fifo          matching every sale of a freshly loaded engine (generate_edavki_xml)
+    fifo_update   re-matching after one back-dated buy
+    xml           streaming all matched pairs to Doh-KDVP XML (_create_xml_file)
+    csv           export_csv of all transactions (export_to_csv)
+    filter        typing a ticker into the filter bar, then a type, a date range and a value range
+    delete        removing 1% of the rows from the table model, engine and journal
+
+The pipeline runs once for wall time and, unless --no-memory is given, once
+more under tracemalloc for each stage's peak allocation (tracemalloc slows
+Python down, so the two are never mixed). Results are written as JSON.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.synthetic import write_portfolio  # noqa: E402
+from slotax.fifo import FifoEngine  # noqa: E402
+from slotax.kdvp import write_kdvp_file  # noqa: E402
+from slotax.model import Transaction, TxType  # noqa: E402
+from slotax.storage import PortfolioStore, export_csv, new_transaction_id  # noqa: E402
+from slotax.table import RowFilter, SortedRows  # noqa: E402
+
+DEFAULT_SIZES = (1000, 100000, 1000000)
+SAVES = 1000
+
+
+class Recorder:
+    """Runs stages and records their wall time, or their peak memory when tracing."""
+    def __init__(self, trace):
+        self.trace = trace
+        self.results = {}
+
+    def stage(self, name, fn, *args):
+        if self.trace:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            result = fn(*args)
+            self.results[name] = tracemalloc.get_traced_memory()[1] - before
+        else:
+            start = time.perf_counter()
+            result = fn(*args)
+            self.results[name] = time.perf_counter() - start
+        return result
+
+
+def run_pipeline(snapshot, workdir, trace):
+    """Runs every stage on a fresh copy of the snapshot and returns {stage: value}."""
+    path = os.path.join(workdir, "portfolio.json")
+    shutil.copyfile(snapshot, path)
+    for leftover in ("portfolio.journal", "portfolio.lots.json"):
+        if os.path.exists(os.path.join(workdir, leftover)):
+            os.remove(os.path.join(workdir, leftover))
+    rec = Recorder(trace)
+    store = PortfolioStore(path)
+
+    def load():
+        transactions = store.load()
+        engine = FifoEngine()
+        engine.load(transactions.values())
+        rows = SortedRows()
+        rows.load(transactions.values())
+        return transactions, engine, rows
+
+    transactions, engine, rows = rec.stage("load", load)
+
+    def save():
+        for i in range(SAVES):
+            tx = Transaction.from_dict({"id": new_transaction_id(), "date": "02.01.2024", "type": "Nakup",
+                                        "ticker": "BENCH", "quantity": 1.5, "price": 10.0 + i, "costs": 0.0})
+            transactions[tx.id] = tx
+            engine.add(tx)
+            rows.insert(tx)
+            store.append(added=[tx])
+
+    rec.stage("save", save)
+    rec.stage("compact", store.compact, transactions)
+
+    issues = rec.stage("fifo", engine.validate)
+    if issues:
+        raise RuntimeError(f"synthetic portfolio has uncovered sales: {issues[0].message}")
+
+    # A back-dated buy in the busiest ticker invalidates most of its matches
+    busiest = max(engine.ledgers.values(), key=len)
+    backdated = Transaction(new_transaction_id(), busiest.buys[0].ordinal + 1, TxType.BUY,
+                            busiest.ticker, 10 ** 8, 10 ** 9, 0)
+    transactions[backdated.id] = backdated
+    engine.add(backdated)
+    rows.insert(backdated)
+    rec.stage("fifo_update", engine.validate)
+
+    year = max(tx.ordinal for tx in transactions.values())
+    year = datetime.fromordinal(year).year
+    xml_path = os.path.join(workdir, "Doh-KDVP.xml")
+    rec.stage("xml", lambda: write_kdvp_file(xml_path, engine.iter_matched_pairs(), year))
+
+    csv_path = os.path.join(workdir, "portfolio.csv")
+    snapshot_list = list(transactions.values())
+    rec.stage("csv", export_csv, csv_path, snapshot_list)
+    del snapshot_list
+
+    def filter_rows():
+        # One filter per keystroke, as the filter bar applies them
+        for i in range(1, len(busiest.ticker) + 1):
+            rows.set_filter(RowFilter(ticker=busiest.ticker[:i]))
+        first = busiest.buys[0].ordinal
+        rows.set_filter(RowFilter(type=TxType.SELL))
+        rows.set_filter(RowFilter(type=TxType.SELL, start=first, end=first + 365))
+        rows.set_filter(RowFilter(type=TxType.SELL, start=first, end=first + 365, min_value=100.0))
+        rows.set_filter(None)
+
+    rec.stage("filter", filter_rows)
+
+    selected = random.Random(0).sample(rows.iids(), max(1, len(rows) // 100))
+
+    def delete():
+        deleted = rows.remove_many(selected)
+        for tx in deleted:
+            del transactions[tx.id]
+            engine.remove(tx)
+        store.append(deleted=deleted)
+
+    rec.stage("delete", delete)
+    store.close()
+    return rec.results
+
+
+def bench_size(n, workdir, memory):
+    snapshot = os.path.join(workdir, f"synthetic-{n}.json")
+    start = time.perf_counter()
+    write_portfolio(snapshot, n)
+    print(f"{n} transactions: generated in {time.perf_counter() - start:.1f} s", flush=True)
+
+    run_dir = os.path.join(workdir, "run")
+    os.makedirs(run_dir, exist_ok=True)
+    seconds = run_pipeline(snapshot, run_dir, trace=False)
+    peaks = {}
+    if memory:
+        tracemalloc.start()
+        try:
+            peaks = run_pipeline(snapshot, run_dir, trace=True)
+        finally:
+            tracemalloc.stop()
+
+    results = []
+    for stage, value in seconds.items():
+        results.append({"size": n, "stage": stage, "seconds": round(value, 6),
+                        "peak_bytes": peaks.get(stage)})
+        peak = f"{peaks[stage] / 2 ** 20:10.1f} MiB" if stage in peaks else ""
+        print(f"  {stage:<12} {value:10.4f} s {peak}", flush=True)
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+
+
+def compare(results, baseline_path):
+    """Prints the time and memory ratio of every stage against an earlier result file."""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {(r["size"], r["stage"]): r for r in json.load(f)["results"]}
+    print(f"\nCompared with {baseline_path} (ratio > 1 is slower / bigger):")
+    for r in results:
+        old = baseline.get((r["size"], r["stage"]))
+        if old is None:
+            continue
+        line = f"  {r['size']:>8} {r['stage']:<12} time x{r['seconds'] / max(old['seconds'], 1e-9):6.2f}"
+        if r["peak_bytes"] is not None and old.get("peak_bytes"):
+            line += f"  memory x{r['peak_bytes'] / old['peak_bytes']:6.2f}"
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the SloTax pipeline on synthetic portfolios.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="portfolio sizes")
+    parser.add_argument("--output", default="bench-results.json", help="JSON result file")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc pass")
+    parser.add_argument("--compare", metavar="FILE", help="earlier result file to compare with")
+    args = parser.parse_args(argv)
+
+    results = []
+    workdir = tempfile.mkdtemp(prefix="slotax-bench-")
+    try:
+        for n in args.sizes:
+            results.extend(bench_size(n, workdir, not args.no_memory))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({"environment": environment(), "results": results}, f, indent=2)
+    print(f"Results written to {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Synthetic portfolios for benchmarking.
+
+The generated history looks like a real long-term ETF investor's: every
+ticker has a monthly savings plan buying a fixed amount (so quantities are
+fractional), there are occasional extra buys, and now and then part of a
+position is sold. Prices follow a random walk per ticker. The same size and
+seed always give the same portfolio.
+
+    python benchmarks/synthetic.py 100000 portfolio.json
+"""
+import argparse
+import json
+import random
+from datetime import date
+
+END_YEAR = 2024  # Histories end in December of this year
+
+
+def _ticker(rng):
+    # ISIN-like symbols, as in Trade Republic exports
+    country = rng.choice(("IE", "LU", "DE", "US", "FR"))
+    return country + "".join(rng.choice("ABCDEFGHJKLMNPQRSTUVWXYZ0123456789") for _ in range(9)) + str(rng.randrange(10))
+
+
+def generate_portfolio(n, seed=0):
+    """
+    Yields n transactions in the portfolio.json dict form, in date order.
+    The number of tickers grows with n (one per ~200 transactions, between 5
+    and 5000), so every size spans roughly 15 years of monthly plans.
+    """
+    rng = random.Random(seed)
+    tickers = [_ticker(rng) for _ in range(max(5, min(5000, n // 200)))]
+    prices = {ticker: rng.uniform(20, 200) for ticker in tickers}
+    plans = {ticker: (rng.randint(1, 28), rng.choice((25, 50, 100, 150, 250))) for ticker in tickers}
+    positions = dict.fromkeys(tickers, 0.0)
+
+    # About 1.09 transactions per ticker and month; start early enough to end in END_YEAR
+    month = (END_YEAR + 1) * 12 - -(-n // int(len(tickers) * 1.09))
+    produced = 0
+    while True:
+        year, month_of_year = month // 12, month % 12 + 1
+        events = []
+        for ticker in tickers:
+            prices[ticker] *= rng.lognormvariate(0.005, 0.05)
+            day, amount = plans[ticker]
+            events.append((day, ticker, "Nakup", amount))
+            if rng.random() < 0.05:
+                events.append((rng.randint(1, 28), ticker, "Nakup", rng.choice((500, 1000, 2500))))
+            if rng.random() < 0.04:
+                events.append((rng.randint(1, 28), ticker, "Prodaja", rng.uniform(0.1, 0.6)))
+        events.sort()
+
+        for day, ticker, tx_type, size in events:
+            price = round(prices[ticker], 4)
+            if tx_type == "Nakup":
+                quantity = round(size / price, 6)
+                positions[ticker] += quantity
+            else:
+                # Partial sell of the current position, never more than is held
+                quantity = int(positions[ticker] * size * 10 ** 6) / 10 ** 6
+                if quantity <= 0:
+                    continue
+                positions[ticker] -= quantity
+            yield {
+                "id": "%032x" % rng.getrandbits(128),
+                "date": date(year, month_of_year, day).strftime("%d.%m.%Y"),
+                "type": tx_type,
+                "ticker": ticker,
+                "quantity": quantity,
+                "price": price,
+                "costs": 1.0 if tx_type == "Prodaja" or size > 250 else 0.0
+            }
+            produced += 1
+            if produced == n:
+                return
+        month += 1
+
+
+def write_portfolio(path, n, seed=0):
+    """Writes a synthetic portfolio.json without holding all dicts in memory."""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("[")
+        for i, tx in enumerate(generate_portfolio(n, seed)):
+            f.write(",\n" if i else "\n")
+            f.write(json.dumps(tx))
+        f.write("\n]")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic portfolio.json for benchmarking.")
+    parser.add_argument("size", type=int, help="number of transactions")
+    parser.add_argument("path", help="output file")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    write_portfolio(args.path, args.size, args.seed)
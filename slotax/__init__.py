@@ -0,0 +1,6 @@
+"""
+Headless building blocks of the SloTax ETF Manager.
+
+Nothing in this package imports tkinter, so the FIFO calculation and the
+eDavki export can be used without the desktop application.
+"""
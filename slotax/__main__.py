@@ -0,0 +1,5 @@
+import sys
+
+from slotax.cli import main
+
+sys.exit(main())
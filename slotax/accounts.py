@@ -0,0 +1,292 @@
+"""
+Several accounts (brokers) of one taxpayer, matched by FIFO as one portfolio.
+
+FIFO applies to all units of a security a taxpayer holds, whichever broker
+they are with, so a sale at one broker may use up a lot bought at another.
+Each account is a portfolio file of its own (portfolio.json with its
+journal, see storage.py) and keeps its transactions per ticker in sort-key
+order. The FIFO ledger of a ticker is fed with a heapq.merge of these
+already sorted per-account streams, consumed lazily; the histories are
+never concatenated and re-sorted.
+
+The ledgers are the cached results. Adding or deleting a transaction goes
+straight to its ticker's ledger, which only recomputes from that date on.
+Adding or removing an account rebuilds only the ledgers of the tickers it
+trades; every other ticker keeps its matches and checkpoints.
+
+Streams are keyed by ledger ticker, i.e. after the renames of the corporate
+actions (see actions.py), so a renamed security is one stream per account.
+
+The registered accounts are listed in accounts.json next to the
+application: [{"name": ..., "path": ...}, ...]. Without that file there is
+a single account, portfolio.json.
+"""
+import heapq
+import json
+import os
+from bisect import bisect_left
+from operator import attrgetter
+
+from slotax.fifo import FifoEngine
+from slotax.storage import PortfolioStore
+
+ACCOUNTS_FILE = "accounts.json"
+DEFAULT_ACCOUNT = ("Glavni račun", "portfolio.json")
+
+
+class Account:
+    """
+    One portfolio file. streams maps each ledger ticker to the (sort keys,
+    transactions) of the account's trades in it, in key order. ledger_key
+    gives the ledger ticker of a transaction; the AccountSet sets it.
+    """
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        self.store = PortfolioStore(path)
+        self.transactions = {}  # Transaction id -> transaction, in file order
+        self.streams = {}
+        self.ledger_key = attrgetter('ticker')
+
+    def __repr__(self):
+        return f"Account({self.name!r}, {self.path!r})"
+
+    def load(self, read_only=False):
+        """
+        Reads the account from disk and groups it into streams. A missing
+        file is an empty account. With read_only the file is never written,
+        see PortfolioStore.read().
+        """
+        if not self.store.exists():
+            self.transactions = {}
+        else:
+            self.transactions = self.store.read() if read_only else self.store.load()
+        self.streams = self._group(self.transactions.values())
+
+    def regroup(self):
+        """Rebuilds the streams after ledger_key has changed."""
+        self.streams = self._group(self.transactions.values())
+
+    def _group(self, transactions):
+        streams = {}
+        for tx in sorted(transactions, key=attrgetter('key')):
+            key = self.ledger_key(tx)
+            stream = streams.get(key)
+            if stream is None:
+                stream = streams[key] = ([], [])
+            stream[0].append(tx.key)
+            stream[1].append(tx)
+        return streams
+
+    def add(self, tx):
+        self.transactions[tx.id] = tx
+        key = self.ledger_key(tx)
+        stream = self.streams.get(key)
+        if stream is None:
+            stream = self.streams[key] = ([], [])
+        i = bisect_left(stream[0], tx.key)
+        stream[0].insert(i, tx.key)
+        stream[1].insert(i, tx)
+
+    def remove(self, tx):
+        del self.transactions[tx.id]
+        key = self.ledger_key(tx)
+        keys, stream = self.streams[key]
+        i = bisect_left(keys, tx.key)
+        del keys[i]
+        del stream[i]
+        if not keys:
+            del self.streams[key]
+
+    def extend(self, transactions):
+        """
+        Adds many transactions at once and returns the tickers they touch.
+        Each touched stream is merged with the new trades of its ticker.
+        """
+        added = {}
+        for tx in sorted(transactions, key=attrgetter('key')):
+            self.transactions[tx.id] = tx
+            added.setdefault(self.ledger_key(tx), []).append(tx)
+        for ticker, new in added.items():
+            old = self.streams.get(ticker, ((), ()))[1]
+            stream = list(heapq.merge(old, new, key=attrgetter('key')))
+            self.streams[ticker] = ([tx.key for tx in stream], stream)
+        return set(added)
+
+
+class AccountSet:
+    """
+    The registered accounts and one FifoEngine over their union, with the
+    given corporate actions. transactions holds every account's
+    transactions by id.
+    """
+    def __init__(self, accounts=(), actions=None):
+        self.accounts = list(accounts)
+        self.engine = FifoEngine(actions)
+        self.transactions = {}
+        self._owners = {}  # Transaction id -> Account
+        for account in self.accounts:
+            account.ledger_key = self._ledger_key
+
+    def _ledger_key(self, tx):
+        return self.engine.ledger_key(tx)
+
+    @property
+    def actions(self):
+        return self.engine.actions
+
+    @property
+    def primary(self):
+        """The first account; the shared FIFO checkpoints are cached next to its file."""
+        return self.accounts[0]
+
+    def get(self, name):
+        for account in self.accounts:
+            if account.name == name:
+                return account
+        raise KeyError(name)
+
+    def account_of(self, tx):
+        return self._owners[tx.id]
+
+    def exists(self):
+        return any(account.store.exists() for account in self.accounts)
+
+    def load(self, read_only=False):
+        """
+        Loads every account and builds all ledgers. Accounts sharing
+        transaction ids are refused, see attach().
+        """
+        self.engine = FifoEngine(self.actions)
+        tickers = set()
+        for account in self.accounts:
+            account.load(read_only)
+            tickers.update(account.streams)
+        self._index()
+        if len(self.transactions) != sum(len(account.transactions) for account in self.accounts):
+            raise ValueError("Več računov vsebuje iste transakcije (kopija portfelja?).")
+        self._rebuild(tickers)
+
+    def set_actions(self, actions):
+        """
+        Switches to other corporate actions: the streams are regrouped and
+        every ledger is rebuilt in a new engine. The trades stay as they are.
+        """
+        self.engine = FifoEngine(actions)
+        tickers = set()
+        for account in self.accounts:
+            account.regroup()
+            tickers.update(account.streams)
+        self._rebuild(tickers)
+
+    def add_account(self, account):
+        """Registers and loads another account; returns the tickers it brings in."""
+        self.prepare(account)
+        account.load()
+        return self.attach(account)
+
+    def prepare(self, account):
+        """
+        First step of add_account(): checks that neither the file nor the
+        name is registered yet and lets the account group its trades by
+        ledger. The account can then be loaded on a worker thread, as it
+        touches nothing shared; attach() has to run where the set is used.
+        """
+        if any(os.path.abspath(a.path) == os.path.abspath(account.path) for a in self.accounts):
+            raise ValueError(f"Datoteka '{account.path}' je že dodana kot račun.")
+        if any(a.name == account.name for a in self.accounts):
+            raise ValueError(f"Račun z imenom '{account.name}' že obstaja.")
+        account.ledger_key = self._ledger_key
+
+    def attach(self, account):
+        """
+        Registers a prepared and loaded account; returns the tickers it
+        brings in. Refuses an account sharing transaction ids with one
+        already registered, such as a copy of its portfolio file.
+        """
+        if not self.transactions.keys().isdisjoint(account.transactions):
+            owner = next(self._owners[tx_id] for tx_id in account.transactions if tx_id in self.transactions)
+            raise ValueError(f"Transakcije v '{account.path}' so že v računu '{owner.name}' (kopija portfelja?).")
+        self.accounts.append(account)
+        self._index()
+        self._rebuild(account.streams)
+        return set(account.streams)
+
+    def remove_account(self, account):
+        """Unregisters an account (its file stays as it is); returns the tickers that changed."""
+        self.accounts.remove(account)
+        account.store.close()
+        self._index()
+        self._rebuild(account.streams)
+        return set(account.streams)
+
+    def _index(self):
+        # Updated in place: callers may hold on to the transactions dict
+        self.transactions.clear()
+        self._owners.clear()
+        for account in self.accounts:
+            self.transactions.update(account.transactions)
+            self._owners.update(dict.fromkeys(account.transactions, account))
+
+    def _rebuild(self, tickers):
+        for ticker in tickers:
+            streams = [account.streams[ticker][1] for account in self.accounts if ticker in account.streams]
+            self.engine.load_ticker(ticker, heapq.merge(*streams, key=attrgetter('key')))
+
+    def add(self, account, tx):
+        account.add(tx)
+        self.transactions[tx.id] = tx
+        self._owners[tx.id] = account
+        self.engine.add(tx)
+
+    def add_many(self, account, transactions):
+        """
+        Adds a large batch (an import) to an account. The touched tickers
+        get new ledgers merged from the account streams, which is cheaper
+        than thousands of single inserts.
+        """
+        touched = account.extend(transactions)
+        for tx in transactions:
+            self.transactions[tx.id] = tx
+            self._owners[tx.id] = account
+        self._rebuild(touched)
+
+    def remove(self, tx):
+        """Removes a transaction from its account and the engine; returns the account."""
+        account = self._owners.pop(tx.id)
+        account.remove(tx)
+        del self.transactions[tx.id]
+        self.engine.remove(tx)
+        return account
+
+    def close(self):
+        for account in self.accounts:
+            account.store.close()
+
+
+def read_accounts(path=ACCOUNTS_FILE, actions=None):
+    """
+    Returns an AccountSet with the accounts listed in the given file, or
+    with the default portfolio.json alone if the file does not exist.
+    Relative paths are taken relative to the file.
+    """
+    if not os.path.exists(path):
+        return AccountSet([Account(*DEFAULT_ACCOUNT)], actions)
+    with open(path, 'rb') as f:
+        entries = json.loads(f.read().decode('utf-8'))
+    base = os.path.dirname(path)
+    accounts = [Account(entry['name'], os.path.join(base, entry['path'])) for entry in entries]
+    if not accounts:
+        raise ValueError(f"V datoteki '{path}' ni nobenega računa.")
+    return AccountSet(accounts, actions)
+
+
+def write_accounts(accounts, path=ACCOUNTS_FILE):
+    """Writes the list of accounts (an AccountSet) to the given file."""
+    base = os.path.dirname(os.path.abspath(path))
+    entries = [{"name": account.name, "path": os.path.relpath(os.path.abspath(account.path), base)}
+               for account in accounts.accounts]
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(entries, f, indent=4, ensure_ascii=False)
+    os.replace(tmp_path, path)
@@ -0,0 +1,254 @@
+"""
+Corporate actions: splits, reverse splits and ticker changes.
+
+Actions are records of their own, kept in actions.json. Stored trades are
+never rewritten; the FIFO engine consults the actions while matching:
+
+* Renames form an alias map. A trade belongs to the ledger of the ticker its
+  security is known by today: a trade in the old ticker dated before the
+  rename is followed to the new one (through any later renames), found by
+  a binary search over that ticker's rename dates.
+
+* Splits form a per-ledger SplitIndex. Every quantity is converted to one
+  common unit, the units held after all the splits. The cumulative factor
+  of a trade is the product of the ratios of all splits after its date,
+  found by a binary search over the split dates. The factors are scaled by
+  the least common multiple of their denominators, so a reverse split
+  still leaves every quantity an exact integer and FIFO needs no tolerance.
+
+An action takes effect at the start of its date: trades on that day are
+already in the new units or under the new ticker.
+"""
+import json
+import math
+import os
+import uuid
+import zlib
+from bisect import bisect_right
+from fractions import Fraction
+from operator import attrgetter
+
+from slotax.model import SCALE, date_ordinal, format_date
+
+SPLIT = "split"
+RENAME = "rename"
+
+ACTIONS_FILE = "actions.json"
+
+
+def parse_ratio(text):
+    """
+    Parses a split ratio given as 'new:old', e.g. '2:1' for a split or
+    '1:10' for a reverse split, into a Fraction of new units per old unit.
+    """
+    new, sep, old = text.replace('/', ':').partition(':')
+    try:
+        ratio = Fraction(new.strip().replace(',', '.')) / Fraction(old.strip().replace(',', '.') if sep else 1)
+    except (ValueError, ZeroDivisionError):
+        raise ValueError(f"Neveljavno razmerje '{text}'. Uporabite obliko 2:1 ali 1:10.") from None
+    if ratio <= 0 or ratio == 1:
+        raise ValueError(f"Neveljavno razmerje '{text}'. Uporabite obliko 2:1 ali 1:10.")
+    return ratio
+
+
+class CorporateAction:
+    """
+    A split (kind SPLIT, ratio = new units per old unit, below 1 for a
+    reverse split) or a ticker change (kind RENAME, to new_ticker) of ticker
+    on the date given as an ordinal.
+    """
+    __slots__ = ("id", "ordinal", "kind", "ticker", "ratio", "new_ticker")
+
+    def __init__(self, id, ordinal, kind, ticker, ratio=None, new_ticker=None):
+        if kind == SPLIT and (ratio is None or ratio <= 0):
+            raise ValueError("Razdelitev potrebuje pozitivno razmerje.")
+        if kind == RENAME and (not new_ticker or new_ticker == ticker):
+            raise ValueError("Preimenovanje potrebuje nov, drugačen ticker.")
+        if kind not in (SPLIT, RENAME):
+            raise ValueError(f"unknown corporate action: {kind}")
+        self.id = id
+        self.ordinal = ordinal
+        self.kind = kind
+        self.ticker = ticker
+        self.ratio = ratio
+        self.new_ticker = new_ticker
+
+    @classmethod
+    def from_dict(cls, d):
+        kind = d['kind']
+        return cls(
+            d['id'],
+            date_ordinal(d['date']),
+            kind,
+            d['ticker'],
+            parse_ratio(d['ratio']) if kind == SPLIT else None,
+            d.get('new_ticker') if kind == RENAME else None
+        )
+
+    def to_dict(self):
+        d = {"id": self.id, "date": self.date, "kind": self.kind, "ticker": self.ticker}
+        if self.kind == SPLIT:
+            d["ratio"] = f"{self.ratio.numerator}:{self.ratio.denominator}"
+        else:
+            d["new_ticker"] = self.new_ticker
+        return d
+
+    @property
+    def date(self):
+        return format_date(self.ordinal)
+
+    @property
+    def description(self):
+        """How the action is shown to the user."""
+        if self.kind == RENAME:
+            return f"Preimenovanje {self.ticker} v {self.new_ticker}"
+        label = "Razdelitev" if self.ratio > 1 else "Združitev"
+        return f"{label} {self.ticker} {self.ratio.numerator}:{self.ratio.denominator}"
+
+    def __repr__(self):
+        return f"CorporateAction({self.to_dict()!r})"
+
+
+class SplitIndex:
+    """
+    The splits of one ledger. dates holds the split dates in order;
+    multipliers[i] is how many common fixed-point units one fixed-point unit
+    held before dates[i] (and on or after dates[i-1]) is worth. The last
+    multiplier, for trades after every split, is the scale itself.
+    An empty index maps every quantity to itself.
+    """
+    __slots__ = ("dates", "multipliers", "signature")
+
+    def __init__(self, splits=()):
+        splits = sorted(splits, key=attrgetter('ordinal'))
+        self.dates = [split.ordinal for split in splits]
+        factors = [Fraction(1)]
+        for split in reversed(splits):
+            factors.append(factors[-1] * split.ratio)
+        factors.reverse()
+        scale = math.lcm(*(factor.denominator for factor in factors))
+        self.multipliers = [int(factor * scale) for factor in factors]
+        # Seeds the ledger's checkpoint fingerprints, so changed splits invalidate them
+        self.signature = zlib.crc32(repr([(split.ordinal, str(split.ratio)) for split in splits]).encode()) \
+            if splits else 0
+
+    def __bool__(self):
+        return bool(self.dates)
+
+    def multiplier(self, ordinal):
+        return self.multipliers[bisect_right(self.dates, ordinal)]
+
+    def units(self, tx):
+        """The transaction's fixed-point quantity in common units."""
+        return tx.quantity_fp * self.multipliers[bisect_right(self.dates, tx.ordinal)]
+
+    def units_at(self, common, ordinal):
+        """Converts a fixed-point quantity in common units to the units held on the given date."""
+        return round(common / self.multipliers[bisect_right(self.dates, ordinal)])
+
+
+NO_SPLITS = SplitIndex()
+
+
+class AdjustedBuy:
+    """
+    A buy as seen from a later date, after the splits in between: quantity
+    in that date's units and the price per such unit. The costs and the
+    total value are unchanged. Every other attribute is the buy's own.
+    """
+    __slots__ = ("tx", "ratio")
+
+    def __init__(self, tx, ratio):
+        self.tx = tx
+        self.ratio = ratio  # New units per unit bought
+
+    def __getattr__(self, name):
+        return getattr(self.tx, name)
+
+    @property
+    def quantity_fp(self):
+        return round(self.tx.quantity_fp * self.ratio)
+
+    @property
+    def quantity(self):
+        return self.tx.quantity_fp * self.ratio / SCALE
+
+    @property
+    def price(self):
+        return self.tx.price_fp / self.ratio / SCALE
+
+
+def adjusted_buy(buy, splits, held):
+    """
+    The buy in the units whose SplitIndex multiplier is held (those of a
+    later date), or the buy itself if no split lies in between.
+    """
+    bought = splits.multiplier(buy.ordinal)
+    return buy if bought == held else AdjustedBuy(buy, Fraction(bought, held))
+
+
+class CorporateActions:
+    """
+    All corporate actions, indexed for matching. canonical() is the alias
+    map; split_index() returns the SplitIndex of a ledger.
+    """
+    def __init__(self, actions=()):
+        self.actions = sorted(actions, key=attrgetter('ordinal'))
+        self._renames = {}  # Old ticker -> (rename dates, new tickers), by date
+        for action in self.actions:
+            if action.kind == RENAME:
+                dates, targets = self._renames.setdefault(action.ticker, ([], []))
+                dates.append(action.ordinal)
+                targets.append(action.new_ticker)
+        splits = {}
+        for action in self.actions:
+            if action.kind == SPLIT:
+                splits.setdefault(self.canonical(action.ticker, action.ordinal), []).append(action)
+        self._splits = {ticker: SplitIndex(ticker_splits) for ticker, ticker_splits in splits.items()}
+
+    def __len__(self):
+        return len(self.actions)
+
+    def __iter__(self):
+        return iter(self.actions)
+
+    def canonical(self, ticker, ordinal):
+        """The ticker under which a trade of ticker on the given date is matched."""
+        renames = self._renames.get(ticker)
+        while renames is not None:
+            dates, targets = renames
+            i = bisect_right(dates, ordinal)  # First rename after the trade
+            if i == len(dates):
+                break
+            ticker, ordinal = targets[i], dates[i]
+            renames = self._renames.get(ticker)
+        return ticker
+
+    def split_index(self, ticker):
+        return self._splits.get(ticker, NO_SPLITS)
+
+    def with_action(self, action):
+        return CorporateActions(self.actions + [action])
+
+    def without(self, action_id):
+        return CorporateActions(action for action in self.actions if action.id != action_id)
+
+
+def new_action_id():
+    return uuid.uuid4().hex
+
+
+def read_actions(path=ACTIONS_FILE):
+    """Returns the CorporateActions stored in the given file; none if it does not exist."""
+    if not os.path.exists(path):
+        return CorporateActions()
+    with open(path, 'rb') as f:
+        entries = json.loads(f.read().decode('utf-8'))
+    return CorporateActions(CorporateAction.from_dict(entry) for entry in entries)
+
+
+def write_actions(actions, path=ACTIONS_FILE):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump([action.to_dict() for action in actions], f, indent=4, ensure_ascii=False)
+    os.replace(tmp_path, path)
@@ -0,0 +1,263 @@
+"""
+Command-line batch mode: Doh-KDVP reports for many portfolios at once.
+
+    python -m slotax portfolios/ --year 2024 --output-dir reports/
+
+Takes portfolio files (portfolio.json with its journal, as written by the
+desktop application) or directories of them, runs the FIFO matching and the
+XML export for each in a separate process and prints a summary. Nothing here
+imports tkinter, so startup stays fast and it runs on machines without a
+display.
+
+With --combine the portfolios are instead taken as the accounts of one
+taxpayer (e.g. two brokers): FIFO runs over their union and a single
+report is written.
+
+    python -m slotax tr.json ibkr.json --combine --year 2024
+
+Splits and ticker changes are read from actions.json (or --actions) and
+applied to every portfolio while matching.
+
+The portfolio files are only read, never migrated or compacted. The FIFO
+checkpoint cache of a batch run is kept in --output-dir, not next to the
+portfolios; without --output-dir nothing but the reports is written.
+"""
+import argparse
+import csv
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+from slotax.accounts import ACCOUNTS_FILE, Account, AccountSet
+from slotax.actions import ACTIONS_FILE, read_actions
+from slotax.fifo import FifoEngine
+from slotax.fxrates import RateStore
+from slotax.kdvp import write_kdvp_file
+from slotax.storage import PortfolioStore, read_checkpoints, write_checkpoints
+
+# status is "ok", "empty" (no sales that year), "issues" (uncovered sales) or "error"
+BatchResult = namedtuple("BatchResult", "portfolio status output items transactions seconds message")
+
+SUMMARY_FIELDS = BatchResult._fields
+
+
+def find_portfolios(paths):
+    """
+    Expands the given files and directories into a sorted list of portfolio
+    files. Directories contribute their *.json files, except checkpoint caches,
+    account lists and corporate actions.
+    """
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith(".json") and not name.endswith(".lots.json") \
+                        and name not in (ACCOUNTS_FILE, ACTIONS_FILE):
+                    found.append(os.path.join(path, name))
+        else:
+            found.append(path)
+    return found
+
+
+def output_path(portfolio, year, output_dir=None):
+    """Names the report after the portfolio, e.g. reports/mama-Doh-KDVP-2024.xml."""
+    stem = os.path.splitext(os.path.basename(portfolio))[0]
+    directory = output_dir if output_dir is not None else os.path.dirname(portfolio)
+    return os.path.join(directory, f"{stem}-Doh-KDVP-{year}.xml")
+
+
+def checkpoints_path(portfolio, output_dir=None):
+    """The batch run's checkpoint cache for a portfolio, e.g. reports/mama.lots.json; None without output_dir."""
+    if output_dir is None:
+        return None
+    stem = os.path.splitext(os.path.basename(portfolio))[0]
+    return os.path.join(output_dir, f"{stem}.lots.json")
+
+
+def process_portfolio(portfolio, year, output_dir=None, rates_path=None, actions_path=None):
+    """
+    Loads one portfolio, matches its sales and writes the Doh-KDVP file for
+    the year. Runs in a worker process; never raises, every failure is
+    reported in the returned BatchResult. Non-EUR trades are converted with
+    the rate store at rates_path; every worker maps the same file. The
+    corporate actions at actions_path, if given, apply while matching.
+    The portfolio is opened read-only; the checkpoints it caches itself are
+    used, but updated ones are only saved to output_dir.
+    """
+    start = time.perf_counter()
+    output = None
+    items = transactions = 0
+    rates = None
+    try:
+        if rates_path is not None:
+            rates = RateStore(rates_path)
+        store = PortfolioStore(portfolio)
+        if not store.exists():
+            raise FileNotFoundError(f"Datoteka '{portfolio}' ne obstaja.")
+        loaded = store.read()
+        transactions = len(loaded)
+
+        engine = FifoEngine(read_actions(actions_path) if actions_path is not None else None)
+        engine.load(loaded.values())
+        cache = checkpoints_path(portfolio, output_dir)
+        restored = (cache and read_checkpoints(cache)) or store.load_checkpoints()
+        engine.restore_checkpoints(restored)
+
+        output = output_path(portfolio, year, output_dir)
+        status, message, items = _report(engine, year, output, rates)
+        if status != "ok":
+            output = None
+
+        if cache is not None:
+            checkpoints = engine.export_checkpoints()
+            # Equal to the cache read above unless the portfolio changed since the last run
+            if checkpoints != restored:
+                try:
+                    write_checkpoints(cache, checkpoints)
+                except OSError:
+                    pass  # Only a cache
+    except Exception as e:
+        status = "error"
+        message = f"{type(e).__name__}: {e}"
+    finally:
+        if rates is not None:
+            rates.close()
+    return BatchResult(portfolio, status, output, items, transactions,
+                       round(time.perf_counter() - start, 3), message)
+
+
+def process_combined(portfolios, year, output_dir=None, rates_path=None, actions_path=None):
+    """
+    Treats the portfolios as accounts of one taxpayer and writes a single
+    Doh-KDVP file for the FIFO matches over their union. Like
+    process_portfolio, reports every failure in the returned BatchResult.
+    """
+    start = time.perf_counter()
+    output = None
+    items = transactions = 0
+    rates = None
+    try:
+        if rates_path is not None:
+            rates = RateStore(rates_path)
+        accounts = AccountSet((Account(os.path.splitext(os.path.basename(path))[0], path) for path in portfolios),
+                              read_actions(actions_path) if actions_path is not None else None)
+        for account in accounts.accounts:
+            if not account.store.exists():
+                raise FileNotFoundError(f"Datoteka '{account.path}' ne obstaja.")
+        accounts.load(read_only=True)
+        accounts.close()
+        transactions = len(accounts.transactions)
+
+        output = os.path.join(output_dir if output_dir is not None else ".", f"Doh-KDVP-{year}.xml")
+        status, message, items = _report(accounts.engine, year, output, rates)
+        if status != "ok":
+            output = None
+    except Exception as e:
+        status = "error"
+        message = f"{type(e).__name__}: {e}"
+    finally:
+        if rates is not None:
+            rates.close()
+    return BatchResult(" + ".join(portfolios), status, output, items, transactions,
+                       round(time.perf_counter() - start, 3), message)
+
+
+def _report(engine, year, output, rates):
+    """Checks the year's sales and writes the report; returns (status, message, items)."""
+    issues = engine.validate(year=year)
+    if issues:
+        return "issues", " ".join(issue.message for issue in issues), 0
+    if not engine.has_pairs(year):
+        return "empty", f"Ni prodaj za poročanje v letu {year}.", 0
+    return "ok", "", write_kdvp_file(output, engine.iter_matched_pairs(year=year), year, rates)
+
+
+def run_batch(portfolios, year, output_dir=None, workers=None, on_result=None, rates_path=None,
+              actions_path=None):
+    """
+    Processes the portfolios on a process pool and returns their results
+    in the order given. on_result(result), if given, is called as each one
+    finishes. A single portfolio, or workers=1, runs in this process.
+    """
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+    workers = min(workers or os.cpu_count() or 1, len(portfolios))
+
+    if workers <= 1:
+        results = []
+        for portfolio in portfolios:
+            results.append(process_portfolio(portfolio, year, output_dir, rates_path, actions_path))
+            if on_result is not None:
+                on_result(results[-1])
+        return results
+
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(process_portfolio, portfolio, year, output_dir, rates_path, actions_path):
+                   portfolio for portfolio in portfolios}
+        for future in as_completed(futures):
+            result = future.result()
+            results[futures[future]] = result
+            if on_result is not None:
+                on_result(result)
+    return [results[portfolio] for portfolio in portfolios]
+
+
+def write_summary(filename, results):
+    with open(filename, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(SUMMARY_FIELDS)
+        writer.writerows(results)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m slotax",
+        description="Ustvari Doh-KDVP XML datoteke za več portfeljev hkrati (brez grafičnega vmesnika)."
+    )
+    parser.add_argument("paths", nargs="+", help="datoteke portfeljev (.json) ali mape z njimi")
+    parser.add_argument("-y", "--year", type=int, default=datetime.now().year - 1,
+                        help="davčno leto (privzeto: lansko leto)")
+    parser.add_argument("-o", "--output-dir", help="mapa za XML datoteke (privzeto: ob portfelju)")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="število sočasnih procesov (privzeto: število jeder)")
+    parser.add_argument("-s", "--summary", help="zapiši povzetek v CSV datoteko")
+    parser.add_argument("-r", "--rates", default="fxrates.bin",
+                        help="datoteka s tečaji za transakcije v tujih valutah (privzeto: fxrates.bin, če obstaja)")
+    parser.add_argument("-a", "--actions", default=ACTIONS_FILE,
+                        help="datoteka s korporacijskimi dogodki (privzeto: actions.json, če obstaja)")
+    parser.add_argument("-c", "--combine", action="store_true",
+                        help="portfelji so računi istega zavezanca: FIFO čez vse skupaj in eno poročilo")
+    args = parser.parse_args(argv)
+
+    portfolios = find_portfolios(args.paths)
+    if not portfolios:
+        parser.error("ni najdenih portfeljev")
+
+    def report(result):
+        line = f"[{result.status}] {result.portfolio}"
+        if result.output:
+            line += f" -> {result.output} ({result.items} postavk)"
+        if result.message:
+            line += f": {result.message}"
+        print(line, flush=True)
+
+    start = time.perf_counter()
+    rates_path = args.rates if os.path.exists(args.rates) else None
+    actions_path = args.actions if os.path.exists(args.actions) else None
+    if args.combine:
+        if args.output_dir is not None:
+            os.makedirs(args.output_dir, exist_ok=True)
+        results = [process_combined(portfolios, args.year, args.output_dir, rates_path, actions_path)]
+        report(results[0])
+    else:
+        results = run_batch(portfolios, args.year, args.output_dir, args.jobs, report, rates_path, actions_path)
+    if args.summary:
+        write_summary(args.summary, results)
+
+    failed = sum(result.status in ("issues", "error") for result in results)
+    print(f"Obdelanih {len(results)} portfeljev v {time.perf_counter() - start:.1f} s, "
+          f"napak: {failed}.")
+    return 1 if failed else 0
@@ -0,0 +1,202 @@
+"""
+Lightweight instrumentation of the hot paths.
+
+Operations are wrapped with @instrument(name). While the tracer is disabled
+(the default) a wrapped call costs one attribute check, so the decorators
+stay in place in normal use. Once enabled, every call records its wall time
+into per-operation statistics and a bounded event buffer that can be saved
+in the Chrome trace format (open it in chrome://tracing or ui.perfetto.dev).
+
+Peak allocation is measured with tracemalloc, which has a real cost of its
+own and is therefore switched on separately. Each operation's peak counts
+the bytes allocated on top of what was in use when it started. Jobs run on
+worker threads, so when two jobs overlap their peaks include each other's
+allocations.
+"""
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+MAX_EVENTS = 100000  # Oldest trace events are dropped beyond this; statistics are kept
+
+
+class OperationStats:
+    __slots__ = ("name", "calls", "total", "max", "peak")
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.total = 0.0   # Seconds
+        self.max = 0.0     # Seconds
+        self.peak = None   # Bytes, only while tracemalloc is on
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "args", "start", "base", "peak")
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        if self.tracer.memory:
+            self.tracer._enter_memory(self)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter_ns()
+        peak = self.tracer._exit_memory(self) if self.tracer.memory else None
+        self.tracer._record(self.name, self.args, self.start, end, peak)
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Tracer:
+    def __init__(self, max_events=MAX_EVENTS):
+        self.enabled = False
+        self.memory = False
+        self.stats = {}
+        self.events = deque(maxlen=max_events)
+        self._lock = threading.Lock()
+        self._open = []  # Spans measuring memory, innermost last
+        self._started_tracemalloc = False
+        self._origin = time.perf_counter_ns()
+
+    def enable(self, memory=False):
+        """Starts recording; with memory=True also tracks peak allocations."""
+        with self._lock:
+            if memory and not self.memory:
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                    self._started_tracemalloc = True
+                self.memory = True
+            elif not memory and self.memory:
+                self._stop_memory()
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+        with self._lock:
+            if self.memory:
+                self._stop_memory()
+
+    def _stop_memory(self):
+        self.memory = False
+        self._open.clear()
+        # Leave tracemalloc alone if someone else (python -X tracemalloc) started it
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def clear(self):
+        with self._lock:
+            self.stats = {}
+            self.events.clear()
+            self._origin = time.perf_counter_ns()
+
+    def span(self, name, **args):
+        """Context manager that records the block as one call of the operation name."""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, args)
+
+    def _enter_memory(self, span):
+        with self._lock:
+            current, peak = tracemalloc.get_traced_memory()
+            # tracemalloc has a single peak; hand it to the enclosing span before resetting it
+            if self._open:
+                self._open[-1].peak = max(self._open[-1].peak, peak)
+            tracemalloc.reset_peak()
+            span.base = current
+            span.peak = current
+            self._open.append(span)
+
+    def _exit_memory(self, span):
+        with self._lock:
+            if span not in self._open:
+                return None  # Memory tracking was switched on or off meanwhile
+            peak = max(span.peak, tracemalloc.get_traced_memory()[1])
+            self._open.remove(span)
+            if self._open:
+                self._open[-1].peak = max(self._open[-1].peak, peak)
+            return peak - span.base
+
+    def _record(self, name, args, start, end, peak):
+        seconds = (end - start) / 1e9
+        with self._lock:
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = OperationStats(name)
+            stats.calls += 1
+            stats.total += seconds
+            stats.max = max(stats.max, seconds)
+            if peak is not None:
+                stats.peak = peak if stats.peak is None else max(stats.peak, peak)
+                args = dict(args, peak_bytes=peak)
+            self.events.append((name, threading.get_ident(), start, end, args))
+
+    def summary(self):
+        """Returns the OperationStats of every operation, the most time-consuming first."""
+        with self._lock:
+            return sorted(self.stats.values(), key=lambda s: s.total, reverse=True)
+
+    def export_chrome_trace(self, filename):
+        """Writes the recorded events as a Chrome trace (JSON) file."""
+        with self._lock:
+            events = list(self.events)
+            origin = self._origin
+        pid = os.getpid()
+        trace = [{
+            "name": name,
+            "cat": name.split(".")[0],
+            "ph": "X",
+            "ts": (start - origin) / 1000,
+            "dur": (end - start) / 1000,
+            "pid": pid,
+            "tid": tid,
+            "args": args
+        } for name, tid, start, end, args in events]
+        tmp_filename = filename + ".tmp"
+        with open(tmp_filename, 'w', encoding='utf-8') as f:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)
+        os.replace(tmp_filename, filename)
+        return len(trace)
+
+
+tracer = Tracer()
+
+
+def instrument(name, describe=None):
+    """
+    Decorator that records every call of the function as the operation name.
+    describe(*args, **kwargs), if given, returns a dict of details for the
+    trace event; it is only called while tracing is enabled.
+    """
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return fn(*args, **kwargs)
+            details = describe(*args, **kwargs) if describe is not None else {}
+            with _Span(tracer, name, details):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
@@ -0,0 +1,534 @@
+"""
+Headless FIFO engine for the Slovenian capital gains report (Doh-KDVP).
+
+The engine keeps the buys and sales of every ticker in date order together
+with the matched sale-purchase pairs. Adding or removing a transaction only
+invalidates the matches of its ticker from the transaction's date onward, so
+the next call to iter_matched_pairs() (through each ledger's match())
+resumes FIFO at the first invalidated sale instead of replaying the whole
+history.
+
+Quantities are matched as fixed-point integers, so partial lots are split
+exactly and no float tolerance is needed.
+
+For per-year reports the engine also keeps a checkpoint of the FIFO state
+at each 31 December. Checkpoints can be saved next to the portfolio and are
+restored on the next start if nothing up to that year end has changed, so a
+report for one tax year only has to process that year's sales.
+
+Every ledger also keeps a PositionTree of its running position, so adds and
+deletes that would leave a sale uncovered are caught as they are made.
+
+Corporate actions (see actions.py) are applied here, at match time: a trade
+goes to the ledger of its ticker after any later renames, and a ledger with
+splits counts every quantity in common units, so lots bought before a split
+cover sales made after it. The stored trades are never adjusted.
+"""
+import heapq
+import zlib
+from bisect import bisect_left
+from collections import namedtuple
+from operator import attrgetter
+
+from slotax.actions import NO_SPLITS, CorporateActions, adjusted_buy
+from slotax.diagnostics import instrument
+from slotax.model import SCALE, TxType, date_key, format_date, year_of, year_start
+from slotax.positions import PositionIssue, PositionTree, position_issue
+
+# A problem found while matching: the uncovered sale and a message for the user
+Issue = namedtuple("Issue", "ticker sale message")
+
+
+class InsufficientLotsError(Exception):
+    """
+    Raised when a sale is not covered by earlier purchases of the same ticker.
+    """
+    def __init__(self, ticker, sale):
+        self.ticker = ticker
+        self.sale = sale
+        super().__init__(
+            f"Ni dovolj nakupov za kritje prodaje {sale.quantity} enot {ticker} na dan {sale.date}."
+        )
+
+
+_plain_units = attrgetter('quantity_fp')
+
+
+class TickerLedger:
+    """
+    Buys, sales and FIFO matches of a single ticker.
+
+    Buys and sales live in two lists sorted by their transaction sort key,
+    with parallel key lists for bisecting. For every processed sale the ledger
+    stores its matches and the FIFO state after it: the index of the oldest
+    buy that is not used up yet and that buy's remaining fixed-point quantity
+    (None while untouched). The state after sale i-1 is all it takes to
+    resume at sale i, because FIFO always consumes buys from the front.
+
+    The cached matches cover the sales from self.start on, beginning in
+    self.start_state. start is normally 0; after resuming from a year-end
+    checkpoint it is the number of sales before that year, and the earlier
+    years are never replayed unless a report asks for them.
+
+    splits is the SplitIndex of the ticker. Matches, cursors, checkpoints
+    and the position tree are all in its common units; for a ticker without
+    splits these are the plain fixed-point quantities.
+    """
+    def __init__(self, ticker, splits=NO_SPLITS):
+        self.ticker = ticker
+        self.splits = splits
+        self.units = splits.units if splits else _plain_units
+        self.buys = []
+        self.buy_keys = []
+        self.sales = []
+        self.sale_keys = []
+        self.start = 0
+        self.start_state = (0, None)
+        self.sale_matches = []  # One list of (buy, quantity in common units) per processed sale
+        self.cursors = []       # (buy index, remaining quantity) after each processed sale
+        self.checkpoints = {}   # Year -> (sales up to 31 December, buy index, remaining quantity)
+        self.changes = 0        # Bumped on every insert and remove, for caches built on top
+        self.positions = PositionTree()
+
+    def __len__(self):
+        return len(self.buys) + len(self.sales)
+
+    def append(self, tx):
+        """Adds a transaction that sorts after every one already in the ledger, while loading."""
+        if tx.type is TxType.BUY:
+            self.buy_keys.append(tx.key)
+            self.buys.append(tx)
+        else:
+            self.sale_keys.append(tx.key)
+            self.sales.append(tx)
+
+    def insert(self, tx):
+        self.changes += 1
+        key = tx.key
+        if tx.type is TxType.BUY:
+            self.positions.add(tx.ordinal, self.units(tx))
+            i = bisect_left(self.buy_keys, key)
+            self.buy_keys.insert(i, key)
+            self.buys.insert(i, tx)
+            # A buy changes the lots available to every sale on or after its date
+            self._invalidate(bisect_left(self.sale_keys, date_key(tx.ordinal)), tx.ordinal)
+        else:
+            self.positions.add(tx.ordinal, -self.units(tx))
+            i = bisect_left(self.sale_keys, key)
+            self.sale_keys.insert(i, key)
+            self.sales.insert(i, tx)
+            self._invalidate(i, tx.ordinal)
+
+    def remove(self, tx):
+        if tx.type is TxType.BUY:
+            keys, items = self.buy_keys, self.buys
+        else:
+            keys, items = self.sale_keys, self.sales
+        i = bisect_left(keys, tx.key)
+        if i == len(keys) or items[i] is not tx:
+            raise KeyError(tx.id)
+        del keys[i]
+        del items[i]
+        self.changes += 1
+        self.positions.add(tx.ordinal, -self.units(tx) if tx.type is TxType.BUY else self.units(tx))
+        if tx.type is TxType.BUY:
+            self._invalidate(bisect_left(self.sale_keys, date_key(tx.ordinal)), tx.ordinal)
+        else:
+            self._invalidate(i, tx.ordinal)
+
+    def _invalidate(self, sale_index, ordinal):
+        """
+        Drops the cached matches of the sale at sale_index and all later
+        sales, and the checkpoints of the changed year and later years.
+        """
+        if sale_index < self.start:
+            self._restart(0, (0, None))
+        elif sale_index < self.start + len(self.sale_matches):
+            del self.sale_matches[sale_index - self.start:]
+            del self.cursors[sale_index - self.start:]
+        if self.checkpoints:
+            year = year_of(ordinal)
+            self.checkpoints = {y: c for y, c in self.checkpoints.items() if y < year}
+
+    def _restart(self, start, state):
+        self.start = start
+        self.start_state = state
+        self.sale_matches = []
+        self.cursors = []
+
+    def state_at(self, k):
+        """Returns the FIFO state after the first k sales, or None if it is not cached."""
+        if k == self.start:
+            return self.start_state
+        if self.start < k <= self.start + len(self.sale_matches):
+            return self.cursors[k - self.start - 1]
+        return None
+
+    def _seek(self, k):
+        """Makes sure matching can resume at sale k, using the closest checkpoint if needed."""
+        end = self.start + len(self.sale_matches)
+        if self.start <= k <= end:
+            return
+        best = None
+        for checkpoint in self.checkpoints.values():
+            if checkpoint[0] <= k and (best is None or checkpoint[0] > best[0]):
+                best = checkpoint
+        if k > end and (best is None or best[0] <= end):
+            return  # Continuing from the cached matches is just as quick
+        if best is None:
+            best = (0, 0, None)
+        self._restart(best[0], best[1:])
+
+    def sale_range(self, year=None):
+        """Returns the (first, stop) sale indexes of a year, or of all sales."""
+        if year is None:
+            return 0, len(self.sales)
+        return (bisect_left(self.sale_keys, date_key(year_start(year))),
+                bisect_left(self.sale_keys, date_key(year_start(year + 1))))
+
+    @instrument("fifo.match", lambda self, *args: {"ticker": self.ticker})
+    def match(self, first=0, stop=None):
+        """
+        Brings the FIFO matches of sales first..stop-1 (default: all sales)
+        up to date and returns them, one list per sale.
+        Raises InsufficientLotsError for the first sale that cannot be covered;
+        the matches of all earlier sales stay cached.
+        """
+        if stop is None:
+            stop = len(self.sales)
+        self._seek(first)
+
+        buys = self.buys
+        buy_keys = self.buy_keys
+        units = self.units
+        j, remaining = self.cursors[-1] if self.cursors else self.start_state
+
+        for i in range(self.start + len(self.sale_matches), stop):
+            sale = self.sales[i]
+            # Only buys made on or before the sale date can cover it
+            available = bisect_left(buy_keys, date_key(sale.ordinal + 1))
+            quantity_to_sell = units(sale)
+            matches = []
+
+            # Keep matching with the oldest buys until the sale quantity is fully covered
+            while quantity_to_sell > 0:
+                if j >= available:
+                    raise InsufficientLotsError(self.ticker, sale)
+                if remaining is None:
+                    remaining = units(buys[j])
+
+                match_quantity = min(quantity_to_sell, remaining)
+                matches.append((buys[j], match_quantity))
+                remaining -= match_quantity
+                quantity_to_sell -= match_quantity
+
+                # If the oldest buy is fully used up, move on to the next one
+                if remaining <= 0:
+                    j += 1
+                    remaining = None
+
+            self.sale_matches.append(matches)
+            self.cursors.append((j, remaining))
+
+        return self.sale_matches[first - self.start:stop - self.start]
+
+    def open_lots(self, ordinal=None):
+        """
+        Returns the (buy, remaining fixed-point quantity) lots left after all
+        sales, or the lots a new sale on the given date would draw from: the
+        buys made up to that date, less what the sales up to it have used.
+        Buys and quantities are in the units held on that date (after all
+        splits without a date), see actions.adjusted_buy().
+        """
+        if ordinal is None:
+            k, stop = len(self.sales), len(self.buys)
+        else:
+            k = bisect_left(self.sale_keys, date_key(ordinal + 1))
+            stop = bisect_left(self.buy_keys, date_key(ordinal + 1))
+        self.match(k, k)
+        j, remaining = self.state_at(k)
+        if not self.splits:
+            lots = [(buy, buy.quantity_fp) for buy in self.buys[j:stop]]
+            if lots and remaining is not None:
+                lots[0] = (lots[0][0], remaining)
+            return lots
+        held = self.splits.multiplier(ordinal) if ordinal is not None else self.splits.multipliers[-1]
+        lots = [(buy, self.units(buy)) for buy in self.buys[j:stop]]
+        if lots and remaining is not None:
+            lots[0] = (lots[0][0], remaining)
+        return [(adjusted_buy(buy, self.splits, held), round(quantity / held)) for buy, quantity in lots]
+
+    def fingerprints(self):
+        """
+        Returns {year: CRC-32 of the ids of all transactions up to the end of
+        that year, in order} for every year with a transaction. A checkpoint
+        is still valid as long as the fingerprint of its year is unchanged.
+        The ticker's splits seed the CRC, as they change the stored quantities.
+        """
+        result = {}
+        crc = self.splits.signature
+        year = None
+        year_end = None
+        for tx in heapq.merge(self.buys, self.sales, key=attrgetter('key')):
+            if year_end is None or tx.ordinal >= year_end:
+                if year is not None:
+                    result[year] = crc
+                year = year_of(tx.ordinal)
+                year_end = year_start(year + 1)
+            crc = zlib.crc32(tx.id.encode(), crc)
+        if year is not None:
+            result[year] = crc
+        return result
+
+    def year_end_state(self, year):
+        """Returns the checkpoint (sales, buy index, remaining) at 31 December, or None if unknown."""
+        k = bisect_left(self.sale_keys, date_key(year_start(year + 1)))
+        state = self.state_at(k)
+        if state is not None:
+            return (k,) + tuple(state)
+        return self.checkpoints.get(year)
+
+
+class FifoEngine:
+    """
+    Per-ticker FIFO ledgers for the whole portfolio.
+
+    Transactions are model.Transaction records, ordered by their sort key,
+    so same-day transactions keep the order in which they were entered.
+    Ledgers are keyed by ledger_key(), the ticker after the corporate
+    actions' renames.
+    """
+    def __init__(self, actions=None):
+        self.ledgers = {}
+        self.actions = actions if actions is not None else CorporateActions()
+
+    def ledger_key(self, tx):
+        return self.actions.canonical(tx.ticker, tx.ordinal)
+
+    def _new_ledger(self, ticker):
+        self.ledgers[ticker] = TickerLedger(ticker, self.actions.split_index(ticker))
+        return self.ledgers[ticker]
+
+    @instrument("fifo.load")
+    def load(self, transactions):
+        """Replaces the engine contents with the given transactions."""
+        self.ledgers = {}
+        for tx in sorted(transactions, key=attrgetter('key')):
+            key = self.ledger_key(tx)
+            ledger = self.ledgers.get(key)
+            if ledger is None:
+                ledger = self._new_ledger(key)
+            # Appending in key order keeps every list sorted
+            ledger.append(tx)
+        for ledger in self.ledgers.values():
+            ledger.positions = self._build_positions(ledger)
+
+    def load_ticker(self, ticker, transactions):
+        """
+        Replaces the ledger of one ticker with the given transactions, which
+        must already be in sort-key order (e.g. a heapq.merge of sorted
+        streams). They are consumed one by one and never re-sorted. The
+        ledger starts without matches or checkpoints.
+        """
+        ledger = TickerLedger(ticker, self.actions.split_index(ticker))
+        for tx in transactions:
+            ledger.append(tx)
+        if not len(ledger):
+            self.ledgers.pop(ticker, None)
+            return
+        ledger.positions = self._build_positions(ledger)
+        self.ledgers[ticker] = ledger
+
+    @staticmethod
+    def _build_positions(ledger):
+        dates = []
+        net = []
+        units = ledger.units
+        for tx in heapq.merge(ledger.buys, ledger.sales, key=attrgetter('key')):
+            quantity = units(tx) if tx.type is TxType.BUY else -units(tx)
+            if dates and dates[-1] == tx.ordinal:
+                net[-1] += quantity
+            else:
+                dates.append(tx.ordinal)
+                net.append(quantity)
+        return PositionTree(dates, net)
+
+    def add(self, tx):
+        key = self.ledger_key(tx)
+        ledger = self.ledgers.get(key)
+        if ledger is None:
+            ledger = self._new_ledger(key)
+        ledger.insert(tx)
+
+    def remove(self, tx):
+        key = self.ledger_key(tx)
+        ledger = self.ledgers[key]
+        ledger.remove(tx)
+        if not len(ledger):
+            del self.ledgers[key]
+
+    def check_add(self, tx):
+        """
+        Returns a PositionIssue if adding tx would leave a sale uncovered
+        (the position would drop below zero on or after its date), else None.
+        """
+        if tx.type is TxType.BUY:
+            return None
+        key = self.ledger_key(tx)
+        ledger = self.ledgers.get(key)
+        if ledger is None:
+            ledger = TickerLedger(key, self.actions.split_index(key))
+        quantity = ledger.units(tx)
+        ordinal = ledger.positions.first_below(tx.ordinal, quantity)
+        if ordinal is None:
+            return None
+        return position_issue(key, ordinal, ledger.splits.units_at(ledger.positions.position_at(ordinal) - quantity,
+                                                                    ordinal))
+
+    def check_remove(self, transactions):
+        """
+        Returns a PositionIssue for every ticker whose position removing all
+        the given transactions would take below zero.
+        """
+        earliest = {}
+        keyed = [(self.ledger_key(tx), tx) for tx in transactions]
+        for key, tx in keyed:
+            if tx.type is TxType.BUY:
+                earliest[key] = min(tx.ordinal, earliest.get(key, tx.ordinal))
+        if not earliest:
+            return []
+
+        # Apply the whole batch, because sales deleted alongside free up their buys
+        deltas = []
+        for key, tx in keyed:
+            if key in earliest:
+                ledger = self.ledgers[key]
+                quantity = ledger.units(tx)
+                deltas.append((ledger.positions, tx.ordinal, -quantity if tx.type is TxType.BUY else quantity))
+        for tree, ordinal, delta in deltas:
+            tree.add(ordinal, delta)
+        try:
+            issues = []
+            for key, ordinal in earliest.items():
+                ledger = self.ledgers[key]
+                below = ledger.positions.first_below(ordinal, 0)
+                if below is not None:
+                    issues.append(position_issue(
+                        key, below, ledger.splits.units_at(ledger.positions.position_at(below), below)
+                    ))
+            return issues
+        finally:
+            for tree, ordinal, delta in deltas:
+                tree.add(ordinal, -delta)
+
+    @instrument("positions.report")
+    def position_report(self, progress=None):
+        """
+        Checks the running position of every ticker in a single pass and
+        returns a PositionIssue for each ticker that ever goes negative,
+        with the first such date and the lowest position.
+        """
+        issues = []
+        ledgers = list(self.ledgers.values())
+        for i, ledger in enumerate(ledgers):
+            if progress is not None and i % 100 == 0:
+                progress(i / len(ledgers))
+            negative = ledger.positions.first_negative()
+            if negative is not None:
+                ordinal, lowest, lowest_ordinal = negative
+                # In the units held on the day of the lowest position
+                lowest = ledger.splits.units_at(lowest, lowest_ordinal)
+                issues.append(PositionIssue(
+                    ledger.ticker, ordinal, lowest,
+                    f"{ledger.ticker}: stanje je od {format_date(ordinal)} negativno "
+                    f"(najnižje {lowest / SCALE:.4f} enot)."
+                ))
+        return issues
+
+    def validate(self, progress=None, year=None):
+        """
+        Brings the matches of every ticker up to date and returns a list of
+        Issues, one for each ticker with a sale that earlier buys don't cover.
+        With a year, only the sales up to the end of that year are matched.
+        progress(fraction), if given, is called before each ticker.
+        """
+        issues = []
+        ledgers = list(self.ledgers.values())
+        for i, ledger in enumerate(ledgers):
+            if progress is not None:
+                progress(i / len(ledgers))
+            try:
+                ledger.match(*ledger.sale_range(year))
+            except InsufficientLotsError as e:
+                issues.append(Issue(e.ticker, e.sale, str(e)))
+        return issues
+
+    def has_pairs(self, year=None):
+        """Whether there is any matched sale to report. Call validate() first."""
+        return any(any(ledger.match(*ledger.sale_range(year))) for ledger in self.ledgers.values())
+
+    def iter_matched_pairs(self, progress=None, year=None):
+        """
+        Yields all (sale, buy, quantity) pairs, grouped by ticker and ordered
+        by sale date; with a year, only the sales made in that year. A buy
+        from before a split comes adjusted to the units sold, and the
+        quantity is in those units. Only
+        tickers changed since the last call are recomputed, starting from the
+        previous year-end checkpoint where there is one.
+        progress(fraction), if given, is called before each ticker.
+        """
+        ledgers = list(self.ledgers.values())
+        for i, ledger in enumerate(ledgers):
+            if progress is not None:
+                progress(i / len(ledgers))
+            first, stop = ledger.sale_range(year)
+            splits = ledger.splits
+            for sale, matches in zip(ledger.sales[first:stop], ledger.match(first, stop)):
+                if not splits:
+                    for buy, quantity_fp in matches:
+                        yield sale, buy, quantity_fp / SCALE
+                    continue
+                held = splits.multiplier(sale.ordinal)
+                for buy, quantity in matches:
+                    yield sale, adjusted_buy(buy, splits, held), quantity / held / SCALE
+
+    def export_checkpoints(self):
+        """
+        Returns the year-end checkpoints of every ticker in a JSON-friendly
+        form: {ticker: {year: [fingerprint, sales, buy index, remaining]}}.
+        Only states that are known (matched or restored) are included.
+        """
+        data = {}
+        for ticker, ledger in self.ledgers.items():
+            entries = {}
+            for year, crc in ledger.fingerprints().items():
+                checkpoint = ledger.year_end_state(year)
+                if checkpoint is not None:
+                    ledger.checkpoints[year] = checkpoint
+                    entries[str(year)] = [crc] + list(checkpoint)
+            if entries:
+                data[ticker] = entries
+        return data
+
+    def restore_checkpoints(self, data):
+        """
+        Restores checkpoints saved by export_checkpoints(), keeping only the
+        ones whose year and all earlier transactions are unchanged.
+        Returns the number of checkpoints restored.
+        """
+        restored = 0
+        for ticker, entries in data.items():
+            ledger = self.ledgers.get(ticker)
+            if ledger is None or not isinstance(entries, dict):
+                continue
+            fingerprints = ledger.fingerprints()
+            for year, entry in entries.items():
+                try:
+                    year = int(year)
+                    crc, k, j, remaining = entry
+                except (TypeError, ValueError):
+                    continue  # Damaged cache entry; the year is simply recomputed
+                if fingerprints.get(year) == crc:
+                    ledger.checkpoints[year] = (k, j, remaining)
+                    restored += 1
+        return restored
@@ -0,0 +1,270 @@
+"""
+Offline store of the reference exchange rates for non-EUR transactions.
+
+eDavki wants values in EUR, converted at the reference rate of the trade
+date. The official history (the ECB eurofxref-hist CSV or XML, or the Banka
+Slovenije tečajnica XML) is imported once into fxrates.bin. That file is
+memory-mapped and indexed by date, so a lookup is one array index without
+any parsing.
+
+Layout of fxrates.bin (the rates in native byte order, i.e. little endian
+on every platform the application runs on):
+
+    header      magic, first date ordinal, number of days, number of currencies
+    currencies  3-letter codes, 4 bytes each, padded to a multiple of 8 bytes
+    rates       float64 [day][currency]: units of the currency per 1 EUR
+    ages        uint8 [day][currency]: 0 if published on that day, otherwise
+                how many days earlier the rate in that cell was published
+
+Weekends and holidays are filled in at import time with the previous
+business day's rate (at most MAX_FALLBACK_DAYS back), so the fallback costs
+nothing at lookup time. The ages keep the published rates apart, so a later
+import can be merged with the existing history.
+"""
+import csv
+import io
+import math
+import mmap
+import os
+import struct
+import xml.etree.ElementTree as ET
+from array import array
+
+from slotax.importer import parse_date, parse_number
+from slotax.model import EUR, format_date
+
+MAGIC = b"SLOFXRT1"
+HEADER = struct.Struct("<8sIII4x")
+MAX_FALLBACK_DAYS = 7   # Longest gap (Easter, New Year) bridged by the previous business day
+NO_RATE = 255
+
+
+class MissingRateError(ValueError):
+    """Raised when there is no reference rate for a currency on a date."""
+
+
+def iter_rates_csv(f):
+    """
+    Yields (ordinal, currency, rate) from a rate table opened in binary
+    mode: a date column followed by one column per currency, as in the
+    ECB's eurofxref-hist.csv. Empty and 'N/A' cells are skipped.
+    """
+    text = io.TextIOWrapper(f, encoding='utf-8-sig', newline='')
+    first_line = text.readline()
+    delimiter = ";" if first_line.count(";") > first_line.count(",") else ","
+    header = [name.strip().upper() for name in next(csv.reader([first_line], delimiter=delimiter))]
+    columns = [(i, name) for i, name in enumerate(header) if i and len(name) == 3 and name.isascii() and name.isalpha()]
+    if not columns:
+        raise ValueError("V datoteki ni stolpcev s tečaji valut.")
+    for row in csv.reader(text, delimiter=delimiter):
+        if not row or not row[0].strip():
+            continue
+        ordinal = parse_date(row[0])
+        for i, currency in columns:
+            if i < len(row) and row[i].strip() and row[i].strip().upper() != "N/A":
+                yield ordinal, currency, parse_number(row[i])
+
+
+def iter_rates_xml(path):
+    """
+    Yields (ordinal, currency, rate) from the ECB XML feed (Cube time /
+    Cube currency rate) or a Banka Slovenije tečajnica (tecajnica datum /
+    tecaj oznaka). Elements are matched by their attributes, so namespaces
+    don't matter.
+    """
+    ordinal = None
+    for event, element in ET.iterparse(path, events=("start", "end")):
+        if event == "start":
+            day = element.get("time") or element.get("datum")
+            if day:
+                ordinal = parse_date(day)
+            continue
+        currency = element.get("currency") or element.get("oznaka")
+        if currency and ordinal is not None:
+            value = element.get("rate") or element.text
+            if value and value.strip():
+                yield ordinal, currency.strip().upper(), parse_number(value)
+        if element.get("time") or element.get("datum"):
+            element.clear()
+
+
+class RateStore:
+    """
+    Read access to fxrates.bin and imports into it. A store whose file does
+    not exist yet is empty: EUR amounts pass through, any other currency
+    raises MissingRateError.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._map = None
+        self._rates = None
+        self._columns = {}
+        self.first = self.days = 0
+        self._open()
+
+    def _open(self):
+        if not os.path.exists(self.path):
+            return
+        self._file = open(self.path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.first, self.days, count = HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"Datoteka '{self.path}' ni datoteka s tečaji.")
+        codes = self._map[HEADER.size:HEADER.size + 4 * count].decode('ascii')
+        self._columns = {codes[4 * i:4 * i + 3]: i for i in range(count)}
+        start = _rates_offset(count)
+        self._rates = memoryview(self._map)[start:start + 8 * self.days * count].cast('d')
+
+    def close(self):
+        if self._rates is not None:
+            self._rates.release()
+            self._rates = None
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._columns = {}
+        self.first = self.days = 0
+
+    @property
+    def currencies(self):
+        return sorted(self._columns)
+
+    @property
+    def date_range(self):
+        """(first, last) date ordinal covered, or None for an empty store."""
+        return (self.first, self.first + self.days - 1) if self.days else None
+
+    def rate(self, currency, ordinal):
+        """
+        Returns the reference rate (units of currency per EUR) for the date,
+        or the previous business day's rate on weekends and holidays.
+        """
+        if currency == EUR:
+            return 1.0
+        column = self._columns.get(currency)
+        day = ordinal - self.first
+        if column is not None and 0 <= day < self.days:
+            rate = self._rates[day * len(self._columns) + column]
+            if rate == rate:  # Not NaN
+                return rate
+        raise MissingRateError(
+            f"Ni tečaja {currency} za dan {format_date(ordinal)}. Uvozite tečajnico ECB ali Banke Slovenije."
+        )
+
+    def published(self):
+        """Returns {currency: {ordinal: rate}} of the rates actually published (not filled in)."""
+        result = {}
+        if not self.days:
+            return result
+        count = len(self._columns)
+        ages_start = _rates_offset(count) + 8 * self.days * count
+        ages = self._map[ages_start:ages_start + self.days * count]
+        for currency, column in self._columns.items():
+            series = result[currency] = {}
+            for day in range(self.days):
+                i = day * count + column
+                if ages[i] == 0:
+                    series[self.first + day] = self._rates[i]
+        return result
+
+    def import_file(self, filename):
+        """
+        Merges the rates of a CSV or XML rate table into the store and
+        returns how many rates were read. The store file is rewritten under
+        a temporary name and moved into place.
+        """
+        read = self.stage_import(filename)
+        self.commit_import()
+        return read
+
+    def stage_import(self, filename):
+        """
+        First step of import_file(): writes the merged rates to the
+        temporary file and returns how many were read. It only reads the
+        open store, so it can run on a worker thread while lookups go on;
+        commit_import() has to run where the lookups are made.
+        """
+        series = self.published()
+        read = 0
+        if filename.lower().endswith(".xml"):
+            rows = iter_rates_xml(filename)
+            f = None
+        else:
+            f = open(filename, 'rb')
+            rows = iter_rates_csv(f)
+        try:
+            for ordinal, currency, rate in rows:
+                if rate > 0:
+                    series.setdefault(currency, {})[ordinal] = rate
+                    read += 1
+        finally:
+            if f is not None:
+                f.close()
+        if not read:
+            raise ValueError(f"V datoteki '{filename}' ni tečajev.")
+
+        data = build(series)
+        with open(self.path + ".tmp", 'wb') as out:
+            out.write(data)
+        return read
+
+    def commit_import(self):
+        """Moves the file written by stage_import() into place and maps it."""
+        # The mapping must be closed before the file can be replaced on Windows
+        self.close()
+        os.replace(self.path + ".tmp", self.path)
+        self._open()
+
+
+def eur_price_costs(tx, rates):
+    """
+    Returns (price, costs) of a transaction in EUR, converted at the
+    reference rate of its date. rates may be None if all trades are in EUR.
+    """
+    if tx.currency == EUR:
+        return tx.price, tx.costs
+    if rates is None:
+        raise MissingRateError(f"Za transakcije v {tx.currency} najprej uvozite tečajnico ECB ali Banke Slovenije.")
+    rate = rates.rate(tx.currency, tx.ordinal)
+    return tx.price / rate, tx.costs / rate
+
+
+def _rates_offset(count):
+    return HEADER.size + (4 * count + 7) // 8 * 8
+
+
+def build(series):
+    """Builds the contents of fxrates.bin from {currency: {ordinal: rate}}."""
+    series = {currency: rates for currency, rates in series.items() if rates and currency != EUR}
+    currencies = sorted(series)
+    if not currencies:
+        raise ValueError("Ni tečajev.")
+    first = min(min(rates) for rates in series.values())
+    last = max(max(rates) for rates in series.values())
+    days, count = last - first + 1, len(currencies)
+
+    rates = array('d', [math.nan]) * (days * count)
+    ages = bytearray([NO_RATE]) * (days * count)
+    for column, currency in enumerate(currencies):
+        published = series[currency]
+        rate, age = math.nan, NO_RATE
+        for day in range(days):
+            value = published.get(first + day)
+            if value is not None:
+                rate, age = value, 0
+            elif age < MAX_FALLBACK_DAYS:
+                age += 1
+            else:
+                rate, age = math.nan, NO_RATE
+            i = day * count + column
+            rates[i] = rate
+            ages[i] = age
+
+    codes = b"".join(currency.encode('ascii')[:3].ljust(4, b"\0") for currency in currencies)
+    codes = codes.ljust(_rates_offset(count) - HEADER.size, b"\0")
+    return HEADER.pack(MAGIC, first, days, count) + codes + rates.tobytes() + bytes(ages)
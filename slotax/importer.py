@@ -0,0 +1,255 @@
+"""
+Bulk import of Trade Republic transaction exports.
+
+Rows are parsed one at a time and turned into transactions in a single
+pass, so memory use does not depend on the size of the export. Two formats
+are understood:
+
+*   The CSV transaction export. Columns are recognised by name (English,
+    German or Slovenian), the delimiter may be ',' or ';' and numbers may
+    use a decimal comma. Only buys, savings plan executions and sales are
+    imported; dividends, deposits, interest etc. are skipped.
+*   The text layer of account statement PDFs. This needs the optional
+    'pypdf' package and is best effort: statements without a text layer
+    (scans) cannot be read.
+
+Imported rows are deduplicated against the existing transactions by a
+content key, so importing the same export twice adds nothing.
+"""
+import csv
+import io
+import os
+import re
+from collections import Counter, namedtuple
+from datetime import date, datetime
+
+from slotax.diagnostics import instrument
+from slotax.model import EUR, Transaction, TxType, to_fixed
+from slotax.storage import new_transaction_id
+
+ImportResult = namedtuple("ImportResult", "added duplicates skipped")
+
+# Header names per field, in order of preference
+COLUMNS = {
+    'date': ("date", "datum", "datetime", "booking date", "buchungsdatum", "valuta"),
+    'type': ("type", "typ", "transaction type", "tip", "category"),
+    'ticker': ("symbol", "ticker", "isin"),
+    'quantity': ("shares", "quantity", "anzahl", "stück", "stueck", "menge", "količina"),
+    'price': ("price", "kurs", "preis", "cena", "cena na enoto"),
+    'amount': ("amount", "betrag", "total", "value", "wert", "znesek"),
+    'costs': ("fee", "fees", "gebühr", "gebühren", "kosten", "costs", "stroški"),
+    'currency': ("currency", "währung", "waehrung", "ccy"),
+}
+
+# Checked in this order, because e.g. "verkauf" contains "kauf"
+TYPE_KEYWORDS = (
+    ("sell", TxType.SELL), ("verkauf", TxType.SELL), ("prodaja", TxType.SELL),
+    ("buy", TxType.BUY), ("kauf", TxType.BUY), ("savings", TxType.BUY),
+    ("sparplan", TxType.BUY), ("nakup", TxType.BUY),
+)
+
+DATE_FORMATS = ("%Y-%m-%d", "%d.%m.%Y", "%d/%m/%Y", "%d.%m.%y")
+
+MONTHS = {
+    "jan": 1, "feb": 2, "mar": 3, "mär": 3, "apr": 4, "may": 5, "mai": 5, "jun": 6,
+    "jul": 7, "aug": 8, "sep": 9, "oct": 10, "okt": 10, "nov": 11, "dec": 12, "dez": 12,
+}
+
+# One trade in the text layer of an account statement, e.g.
+# "02 Jan. 2024 Trade Savings plan execution IE00BK5BQT80 ..., quantity: 0.384615 25,00 €"
+# The trade type must be on the line of the date; otherwise a row that is
+# not a trade (interest, a dividend) could lend its date to the next trade.
+PDF_TRADE = re.compile(
+    r"(?P<day>\d{1,2})\s+(?P<month>[A-Za-zä]{3})[a-zä]*\.?\s+(?P<year>\d{4})\s+[^\n]*?"
+    r"(?P<type>Savings plan execution|Sparplanausführung|Buy trade|Sell trade|Kauf|Verkauf)\s+"
+    r"(?P<isin>[A-Z]{2}[A-Z0-9]{9}\d).*?"
+    r"(?:quantity|Menge|Anzahl|Stück):?\s*(?P<quantity>[\d.,]+).*?"
+    r"(?P<amount>\d[\d.,]*)\s*€",
+    re.DOTALL
+)
+
+
+class ImportFormatError(ValueError):
+    """Raised when a file is not a recognisable Trade Republic export."""
+
+
+def parse_number(text):
+    """
+    Parses numbers such as '1.234,56', '1,234.56', '-25.00' or '25,00 €'.
+    The last of ',' and '.' is taken to be the decimal separator.
+    """
+    text = re.sub(r"[^\d,.\-]", "", text)
+    if not text:
+        raise ValueError("empty number")
+    if "," in text and "." in text:
+        if text.rfind(",") > text.rfind("."):
+            text = text.replace(".", "").replace(",", ".")
+        else:
+            text = text.replace(",", "")
+    elif "," in text:
+        text = text.replace(",", ".")
+    return float(text)
+
+
+def parse_date(text):
+    """Converts an export date (with or without a time) to a date ordinal."""
+    text = text.strip()[:10]
+    if len(text) == 10 and text[4] == text[7] == "-" and text.replace("-", "").isdigit():
+        # ISO dates are by far the most common; skip strptime for them
+        year, month, day = text.split("-")
+        return date(int(year), int(month), int(day)).toordinal()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).toordinal()
+        except ValueError:
+            pass
+    raise ValueError(f"unknown date format: {text}")
+
+
+def parse_type(text):
+    text = text.lower()
+    for keyword, tx_type in TYPE_KEYWORDS:
+        if keyword in text:
+            return tx_type
+    return None
+
+
+def content_key(tx):
+    """
+    Identifies a trade by its contents, for recognising already imported
+    rows. Quantities are compared to 6 decimals and prices to 4.
+    """
+    return (tx.ordinal, tx.type, tx.ticker, round(tx.quantity_fp, -2), round(tx.price_fp, -4))
+
+
+def _map_columns(header):
+    names = [name.strip().lower() for name in header]
+    mapping = {}
+    for field, aliases in COLUMNS.items():
+        for alias in aliases:
+            if alias in names:
+                mapping[field] = names.index(alias)
+                break
+    missing = {'date', 'type', 'ticker', 'quantity'} - set(mapping)
+    if missing or ('price' not in mapping and 'amount' not in mapping):
+        raise ImportFormatError("Datoteka ni prepoznan izvoz Trade Republic (manjkajo stolpci).")
+    return mapping
+
+
+def _make_transaction(ordinal, tx_type, ticker, quantity, price, costs, currency=EUR):
+    # The id is only assigned once the row turns out not to be a duplicate
+    return Transaction(None, ordinal, tx_type, ticker.strip().upper(),
+                       to_fixed(quantity), to_fixed(price), to_fixed(costs), currency)
+
+
+def iter_csv(f, progress=None):
+    """
+    Yields transactions from a CSV export opened in binary mode, or None
+    for every row that is not a trade. progress(fraction) is called as the
+    file is read.
+    """
+    size = os.fstat(f.fileno()).st_size or 1
+    text = io.TextIOWrapper(f, encoding='utf-8-sig', newline='')
+    first_line = text.readline()
+    delimiter = ";" if first_line.count(";") > first_line.count(",") else ","
+    mapping = _map_columns(next(csv.reader([first_line], delimiter=delimiter)))
+    columns = max(mapping.values()) + 1
+
+    for n, row in enumerate(csv.reader(text, delimiter=delimiter)):
+        if progress is not None and n % 1000 == 0:
+            progress(f.tell() / size)
+        if len(row) < columns:
+            yield None
+            continue
+        try:
+            tx_type = parse_type(row[mapping['type']])
+            if tx_type is None:
+                yield None
+                continue
+            quantity = abs(parse_number(row[mapping['quantity']]))
+            if 'price' in mapping and row[mapping['price']].strip():
+                price = abs(parse_number(row[mapping['price']]))
+            else:
+                price = abs(parse_number(row[mapping['amount']])) / quantity
+            if 'costs' in mapping and row[mapping['costs']].strip():
+                costs = abs(parse_number(row[mapping['costs']]))
+            else:
+                costs = 0.0
+            currency = row[mapping['currency']].strip().upper() if 'currency' in mapping else ""
+            yield _make_transaction(parse_date(row[mapping['date']]), tx_type, row[mapping['ticker']],
+                                    quantity, price, costs, currency or EUR)
+        except (ValueError, ZeroDivisionError):
+            yield None
+
+
+def iter_pdf(path, progress=None):
+    """
+    Yields transactions found in the text layer of an account statement PDF.
+    Requires the optional 'pypdf' package.
+    """
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        raise ImportFormatError("Za uvoz PDF izpiskov je potreben paket 'pypdf' (pip install pypdf).")
+
+    reader = PdfReader(path)
+    pages = len(reader.pages) or 1
+    for n, page in enumerate(reader.pages):
+        if progress is not None:
+            progress(n / pages)
+        yield from iter_statement_text(page.extract_text() or "")
+
+
+def iter_statement_text(text):
+    """Yields the transactions found in the text of one statement page, or None for unreadable ones."""
+    for match in PDF_TRADE.finditer(text):
+        try:
+            month = MONTHS[match['month'][:3].lower()]
+            ordinal = date(int(match['year']), month, int(match['day'])).toordinal()
+            quantity = parse_number(match['quantity'])
+            price = parse_number(match['amount']) / quantity
+        except (KeyError, ValueError, ZeroDivisionError):
+            yield None
+            continue
+        yield _make_transaction(ordinal, parse_type(match['type']), match['isin'], quantity, price, 0.0)
+
+
+@instrument("import")
+def import_file(path, existing, progress=None):
+    """
+    Reads a Trade Republic CSV export or PDF statement and returns an
+    ImportResult with the new transactions (already given ids), the number
+    of rows that were already present and the number of rows skipped.
+    existing is an iterable of the transactions already in the portfolio.
+    """
+    seen = Counter(content_key(tx) for tx in existing)
+    added = []
+    duplicates = skipped = 0
+
+    if path.lower().endswith(".pdf"):
+        rows = iter_pdf(path, progress)
+        f = None
+    else:
+        f = open(path, 'rb')
+        rows = iter_csv(f, progress)
+
+    try:
+        for tx in rows:
+            if tx is None:
+                skipped += 1
+                continue
+            key = content_key(tx)
+            if seen[key]:
+                # Already imported (or entered by hand); each existing row absorbs one duplicate
+                seen[key] -= 1
+                duplicates += 1
+                continue
+            tx.id = new_transaction_id()
+            added.append(tx)
+    finally:
+        if f is not None:
+            f.close()
+
+    if progress is not None:
+        progress(1.0)
+    return ImportResult(added, duplicates, skipped)
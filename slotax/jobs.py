@@ -0,0 +1,106 @@
+"""
+Background jobs for the long-running operations of the application.
+
+Jobs run on a small thread pool. The runner never touches the GUI from a
+worker thread: it polls the running jobs through the scheduling function it
+was given (Tk's root.after) and calls the completion callbacks there.
+
+A job function receives its Job as the last argument and reports progress
+with job.progress(fraction). Once the job has been cancelled, the next
+progress call raises JobCancelled, which unwinds the job cleanly.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+POLL_MS = 50
+
+
+class JobCancelled(Exception):
+    """Raised inside a job function after the job has been cancelled."""
+
+
+class Job:
+    def __init__(self, name, cancellable=True):
+        self.name = name
+        self.cancellable = cancellable
+        self.fraction = 0.0
+        self._cancel = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def progress(self, fraction):
+        """Records the progress of the job; raises JobCancelled once it is cancelled."""
+        self.fraction = fraction
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+
+class JobRunner:
+    """
+    Runs job functions on worker threads and delivers their results through
+    after(ms, callback), which must schedule callbacks on the GUI thread.
+    on_change, if set, is called after every poll while jobs are running
+    and once more when the last one has finished.
+    """
+    def __init__(self, after, max_workers=2):
+        self.after = after
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.running = {}  # Job -> (future, on_done, on_error, on_cancel)
+        self.on_change = None
+        self._polling = False
+
+    def submit(self, name, fn, *args, on_done=None, on_error=None, on_cancel=None, cancellable=True):
+        """
+        Starts fn(*args, job) on a worker thread and returns the Job.
+        Jobs that are not cancellable are left running by cancel_all().
+        """
+        job = Job(name, cancellable)
+        future = self.executor.submit(fn, *args, job)
+        self.running[job] = (future, on_done, on_error, on_cancel)
+        if not self._polling:
+            self._polling = True
+            self.after(POLL_MS, self._poll)
+        return job
+
+    def cancel_all(self):
+        for job in self.running:
+            if job.cancellable:
+                job.cancel()
+
+    def shutdown(self, wait=False):
+        """Cancels the jobs; with wait=True, also waits until their threads have stopped."""
+        self.cancel_all()
+        self.executor.shutdown(wait=wait)
+
+    def _poll(self):
+        try:
+            for job, (future, on_done, on_error, on_cancel) in list(self.running.items()):
+                if not future.done():
+                    continue
+                del self.running[job]
+                try:
+                    result = future.result()
+                except JobCancelled:
+                    if on_cancel is not None:
+                        on_cancel()
+                except Exception as e:
+                    if on_error is None:
+                        raise
+                    on_error(e)
+                else:
+                    if on_done is not None:
+                        on_done(result)
+
+            if self.on_change is not None:
+                self.on_change()
+        finally:
+            # Keep polling even if a callback failed
+            if self.running:
+                self.after(POLL_MS, self._poll)
+            else:
+                self._polling = False
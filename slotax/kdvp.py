@@ -0,0 +1,125 @@
+"""
+Streaming writer for the eDavki Doh-KDVP XML form.
+
+KDVP items are written to the output file one matched pair at a time, with
+the indentation written as it goes, so memory use does not grow with the
+number of lots. The output is byte for byte what building the tree with
+ElementTree and pretty-printing it with minidom's toprettyxml(indent="  ")
+produced.
+"""
+import os
+from xml.sax.saxutils import escape, quoteattr
+
+from slotax.diagnostics import instrument
+from slotax.fxrates import eur_price_costs
+
+NAMESPACE = "http://edavki.durs.si/Documents/Schemas/Doh_KDVP_9.xsd"
+EDP_NAMESPACE = "http://edavki.durs.si/Documents/Schemas/Edp-Common-1.xsd"
+
+# minidom escapes '"' in text nodes as well
+_TEXT_ENTITIES = {'"': "&quot;"}
+
+
+def pair_values(sale, buy, qty, rates=None):
+    """
+    Returns (VrednostOdsvojitve, VrednostPridobitve) in EUR for qty units of
+    a sale matched with a buy. Non-EUR trades are converted at the reference
+    rate of their own date, looked up in rates (a RateStore).
+    """
+    sale_price, sale_costs = eur_price_costs(sale, rates)
+    buy_price, buy_costs = eur_price_costs(buy, rates)
+
+    # Apportion costs based on the quantity being sold
+    # Sale costs are apportioned from the total sale transaction costs
+    prorated_sale_costs = (sale_costs / sale.quantity) * qty if sale.quantity > 0 else 0
+    # Buy costs are apportioned from the total buy transaction costs
+    prorated_buy_costs = (buy_costs / buy.quantity) * qty if buy.quantity > 0 else 0
+
+    # Per eDavki schema:
+    # Vrednost ob pridobitvi = (Nakupna cena * Količina) + Stroški nakupa
+    # Vrednost ob odsvojitvi = (Prodajna cena * Količina) - Stroški prodaje
+    vrednost_odsvojitev = (sale_price * qty) - prorated_sale_costs
+    vrednost_pridobitev = (buy_price * qty) + prorated_buy_costs
+    return vrednost_odsvojitev, vrednost_pridobitev
+
+
+class KdvpWriter:
+    """
+    Writes a Doh_KDVP envelope to a binary file object.
+
+        with KdvpWriter(f, year, rates) as writer:
+            for sale, buy, qty in pairs:
+                writer.write_pair(sale, buy, qty)
+    """
+    def __init__(self, f, year, rates=None):
+        self.f = f
+        self.year = year
+        self.rates = rates
+        self.items = 0
+
+    def __enter__(self):
+        self.f.write(
+            '<?xml version="1.0" encoding="utf-8"?>\n'
+            f'<Envelope xmlns={quoteattr(NAMESPACE)} xmlns:edp={quoteattr(EDP_NAMESPACE)}>\n'
+            '  <body>\n'
+            f'    <Doh_KDVP Leto={quoteattr(str(self.year))}'.encode('utf-8')
+        )
+        return self
+
+    def write_pair(self, sale, buy, qty):
+        vrednost_odsvojitev, vrednost_pridobitev = pair_values(sale, buy, qty, self.rates)
+        if not self.items:
+            self.f.write(b">\n")
+        self.items += 1
+
+        # Oznaka 61 = Vrednostni papirji in deleži; NacinPridobitve A = Nakup
+        self.f.write((
+            '      <KDVP Oznaka="61">\n'
+            '        <Odsvojitev>\n'
+            f'          <DatumOdsvojitve>{escape(sale.date, _TEXT_ENTITIES)}</DatumOdsvojitve>\n'
+            f'          <VrednostOdsvojitve>{vrednost_odsvojitev:.4f}</VrednostOdsvojitve>\n'
+            f'          <SteviloEnot>{qty:.4f}</SteviloEnot>\n'
+            '        </Odsvojitev>\n'
+            '        <Pridobitev>\n'
+            f'          <DatumPridobitve>{escape(buy.date, _TEXT_ENTITIES)}</DatumPridobitve>\n'
+            f'          <VrednostPridobitve>{vrednost_pridobitev:.4f}</VrednostPridobitve>\n'
+            '          <NacinPridobitve>A</NacinPridobitve>\n'
+            f'          <SteviloEnot>{qty:.4f}</SteviloEnot>\n'
+            '        </Pridobitev>\n'
+            '      </KDVP>\n'
+        ).encode('utf-8'))
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            return False
+        # An empty Doh_KDVP element is self-closing, as in minidom's output
+        self.f.write(b"    </Doh_KDVP>\n" if self.items else b"/>\n")
+        self.f.write(b"  </body>\n</Envelope>\n")
+        return False
+
+
+def write_kdvp(f, pairs, year, rates=None):
+    """Streams (sale, buy, quantity) pairs to f and returns the number of items."""
+    with KdvpWriter(f, year, rates) as writer:
+        for sale, buy, qty in pairs:
+            writer.write_pair(sale, buy, qty)
+    return writer.items
+
+
+@instrument("xml.write")
+def write_kdvp_file(filename, pairs, year, rates=None):
+    """
+    Streams the pairs to filename and returns the number of items. The file
+    is written under a temporary name and only moved into place once it is
+    complete, so a failed or cancelled export never leaves a truncated file.
+    """
+    tmp_filename = filename + ".tmp"
+    try:
+        with open(tmp_filename, 'wb') as f:
+            items = write_kdvp(f, pairs, year, rates)
+        os.replace(tmp_filename, filename)
+    except BaseException:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        raise
+    return items
@@ -0,0 +1,152 @@
+"""
+Compact in-memory representation of transactions.
+
+A Transaction is a __slots__ record instead of a dict. Dates are parsed once
+into a proleptic Gregorian ordinal, tickers are interned, the type is a small
+enum and quantity, price and costs are fixed-point integers with 8 decimals.
+
+Every record also carries an integer sort key: the date ordinal in the high
+bits and an entry sequence number in the low bits. Sorting and grouping by
+date (with same-day transactions in the order they were entered) is then a
+plain integer comparison, and every index shares the same int object instead
+of building its own (date, sequence) tuple.
+
+On disk and in CSV exports transactions keep the familiar dict form, see
+to_dict() and from_dict(). Prices and costs are in the transaction's
+currency; files written before currencies were supported are all EUR.
+"""
+import sys
+from datetime import date, datetime
+from enum import IntEnum
+from itertools import count
+
+DATE_FORMAT = "%d.%m.%Y"
+
+BUY = "Nakup"
+SELL = "Prodaja"
+
+EUR = "EUR"
+
+SCALE = 10 ** 8   # Fixed-point scale of quantity, price and costs
+SEQ_BITS = 40     # Low bits of the sort key that hold the entry sequence
+
+FIELDS = ("id", "date", "type", "ticker", "quantity", "price", "costs", "currency")
+
+_seq = count()
+_date_strings = {}  # Ordinal -> 'DD.MM.YYYY'; a portfolio only has a few thousand distinct dates
+
+
+class TxType(IntEnum):
+    BUY = 0
+    SELL = 1
+
+    @property
+    def label(self):
+        return BUY if self is TxType.BUY else SELL
+
+    @classmethod
+    def from_label(cls, label):
+        if label == BUY:
+            return cls.BUY
+        if label == SELL:
+            return cls.SELL
+        raise ValueError(f"unknown transaction type: {label}")
+
+
+def date_ordinal(date_str):
+    """Converts a 'DD.MM.YYYY' date string to a proleptic Gregorian ordinal."""
+    return datetime.strptime(date_str, DATE_FORMAT).toordinal()
+
+
+def format_date(ordinal):
+    """Converts an ordinal back to 'DD.MM.YYYY'."""
+    text = _date_strings.get(ordinal)
+    if text is None:
+        text = _date_strings[ordinal] = date.fromordinal(ordinal).strftime(DATE_FORMAT)
+    return text
+
+
+def year_start(year):
+    """Ordinal of 1 January of the given year."""
+    return date(year, 1, 1).toordinal()
+
+
+def year_of(ordinal):
+    return date.fromordinal(ordinal).year
+
+
+def to_fixed(value):
+    return round(value * SCALE)
+
+
+def date_key(ordinal):
+    """The smallest sort key on the given date; bisect with it to find a day's first entry."""
+    return ordinal << SEQ_BITS
+
+
+class Transaction:
+    """
+    One buy or sale. quantity_fp, price_fp and costs_fp are fixed-point
+    integers; the quantity, price and costs properties return floats.
+    Price and costs are in currency (an ISO code, interned).
+    """
+    __slots__ = ("id", "key", "type", "ticker", "quantity_fp", "price_fp", "costs_fp", "currency")
+
+    def __init__(self, id, ordinal, type, ticker, quantity_fp, price_fp, costs_fp, currency=EUR):
+        self.id = id
+        self.key = (ordinal << SEQ_BITS) | next(_seq)
+        self.type = type
+        self.ticker = sys.intern(ticker)
+        self.quantity_fp = quantity_fp
+        self.price_fp = price_fp
+        self.costs_fp = costs_fp
+        self.currency = sys.intern(currency)
+
+    @classmethod
+    def from_dict(cls, d):
+        """Creates a transaction from its dict form (as stored in portfolio.json)."""
+        return cls(
+            d['id'],
+            date_ordinal(d['date']),
+            TxType.from_label(d['type']),
+            d['ticker'],
+            to_fixed(d['quantity']),
+            to_fixed(d['price']),
+            to_fixed(d['costs']),
+            d.get('currency') or EUR
+        )
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "date": self.date,
+            "type": self.type.label,
+            "ticker": self.ticker,
+            "quantity": self.quantity,
+            "price": self.price,
+            "costs": self.costs,
+            "currency": self.currency
+        }
+
+    @property
+    def ordinal(self):
+        return self.key >> SEQ_BITS
+
+    @property
+    def date(self):
+        return format_date(self.key >> SEQ_BITS)
+
+    @property
+    def quantity(self):
+        return self.quantity_fp / SCALE
+
+    @property
+    def price(self):
+        return self.price_fp / SCALE
+
+    @property
+    def costs(self):
+        return self.costs_fp / SCALE
+
+    def __repr__(self):
+        return f"Transaction({self.to_dict()!r})"
@@ -0,0 +1,137 @@
+"""
+Running position of a ticker over time, for checking edits as they happen.
+
+A sale is covered by FIFO exactly when the buys dated on or before it add up
+to at least all sales up to and including it. That is the same as the
+running position (buys minus sales, summed date by date) never dropping
+below zero. A PositionTree is a segment tree over a ticker's trade dates.
+Each leaf holds the net fixed-point quantity traded that day. Each node
+holds the sum of its range and the lowest running position inside it. A
+change on one date updates one leaf and its ancestors. Finding the first
+date on which the position falls below a threshold is one descent, so a
+back-dated trade is checked in O(log n) without replaying the history.
+"""
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+
+from slotax.model import SCALE, format_date
+
+# A ticker whose position goes negative: the first such date (an ordinal) and the lowest position
+PositionIssue = namedtuple("PositionIssue", "ticker date position message")
+
+
+class PositionTree:
+    """
+    Net quantity per trade date of one ticker. dates is sorted; net[i] is
+    the net quantity traded on dates[i]. The leaves have room to spare, so
+    trades on a new last date (the usual case) never rebuild the tree; only
+    a trade on a new date in the middle of the history does.
+    """
+    def __init__(self, dates=(), net=()):
+        self.dates = list(dates)
+        self.net = list(net)
+        self._build()
+
+    def _build(self):
+        size = 1
+        while size <= len(self.dates):
+            size *= 2
+        self.size = size
+        # Empty leaves are (0, 0): they end the range without moving the position
+        self.sums = sums = [0] * (2 * size)
+        self.mins = mins = [0] * (2 * size)
+        sums[size:size + len(self.net)] = self.net
+        mins[size:size + len(self.net)] = self.net
+        for node in range(size - 1, 0, -1):
+            left = 2 * node
+            sums[node] = sums[left] + sums[left + 1]
+            mins[node] = min(mins[left], sums[left] + mins[left + 1])
+
+    def add(self, ordinal, delta):
+        """Adds delta (positive for a buy, negative for a sale) to the position on the given date."""
+        i = bisect_left(self.dates, ordinal)
+        if i < len(self.dates) and self.dates[i] == ordinal:
+            self.net[i] += delta
+        else:
+            self.dates.insert(i, ordinal)
+            self.net.insert(i, delta)
+            if i < len(self.dates) - 1 or len(self.dates) >= self.size:
+                # Every later leaf moves one place; cheaper to rebuild than to shift the tree
+                self._build()
+                return
+        node = i + self.size
+        self.sums[node] = self.mins[node] = self.net[i]
+        node //= 2
+        sums, mins = self.sums, self.mins
+        while node:
+            left = 2 * node
+            sums[node] = sums[left] + sums[left + 1]
+            mins[node] = min(mins[left], sums[left] + mins[left + 1])
+            node //= 2
+
+    def position_at(self, ordinal):
+        """The position at the end of the given date."""
+        stop = bisect_right(self.dates, ordinal) + self.size
+        node = self.size
+        total = 0
+        # Sum the leaves before stop by walking up from the first leaf's side
+        while node < stop:
+            if node & 1:
+                total += self.sums[node]
+                node += 1
+            if stop & 1:
+                stop -= 1
+                total += self.sums[stop]
+            node //= 2
+            stop //= 2
+        return total
+
+    def first_below(self, ordinal, threshold):
+        """
+        Returns the first date on or after ordinal at the end of which the
+        position is below threshold, or None if there is none.
+        """
+        if self.position_at(ordinal) < threshold:
+            return ordinal
+        start = bisect_left(self.dates, ordinal)
+        if start >= len(self.dates):
+            return None
+        i = self._descend(1, 0, self.size, start, 0, threshold)[0]
+        return self.dates[i] if i is not None else None
+
+    def _descend(self, node, lo, hi, start, before, threshold):
+        """Returns (first leaf >= start below threshold or None, position after hi)."""
+        after = before + self.sums[node]
+        if hi <= start or (lo >= start and before + self.mins[node] >= threshold):
+            return None, after
+        if hi - lo == 1:
+            return lo, after
+        mid = (lo + hi) // 2
+        found, middle = self._descend(2 * node, lo, mid, start, before, threshold)
+        if found is not None:
+            return found, after
+        return self._descend(2 * node + 1, mid, hi, start, middle, threshold)[0], after
+
+    def first_negative(self):
+        """
+        Returns (first date with a negative position, lowest position, date
+        of the lowest position) in one pass over the dates, or None if the
+        position never goes negative.
+        """
+        lowest = self.mins[1]
+        if lowest >= 0:
+            return None
+        running = 0
+        first = None
+        for ordinal, net in zip(self.dates, self.net):
+            running += net
+            if first is None and running < 0:
+                first = ordinal
+            if running == lowest:
+                return first, lowest, ordinal
+        return None
+
+
+def position_issue(ticker, ordinal, position):
+    return PositionIssue(ticker, ordinal, position,
+                         f"Stanje {ticker} na dan {format_date(ordinal)} bi bilo {position / SCALE:.4f} enot.")
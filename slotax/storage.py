@@ -0,0 +1,242 @@
+"""
+Crash-safe storage of the portfolio.
+
+The portfolio is kept as a snapshot (the familiar portfolio.json list of
+transactions) plus an append-only journal next to it. Every add or delete is
+appended to the journal as one JSON line and fsynced, so saving costs the same
+no matter how long the history is. From time to time, and when the
+application closes, the journal is folded into a new snapshot.
+
+The first journal line records the SHA-256 of the snapshot it applies to.
+If a compaction is interrupted after the new snapshot is in place, the stale
+journal no longer matches and is ignored instead of being replayed twice.
+
+Every transaction carries a unique "id". Deletes are journaled by id, so two
+otherwise identical trades can never be confused.
+
+The year-end FIFO checkpoints of the engine are cached in a third file,
+portfolio.lots.json. It is only an optimisation: a missing, stale or damaged
+cache is ignored and the lots are recomputed.
+"""
+import csv
+import hashlib
+import json
+import os
+import uuid
+
+from slotax.diagnostics import instrument
+from slotax.model import FIELDS, Transaction
+
+COMPACT_EVERY = 1000  # Journal records after which the snapshot is rewritten
+
+
+def new_transaction_id():
+    return uuid.uuid4().hex
+
+
+@instrument("csv.export")
+def export_csv(filename, transactions, progress=None):
+    """
+    Writes the transactions (a list of Transaction records) to a CSV file
+    with the same columns as portfolio.json. progress(fraction) is called
+    every 1000 rows; the file is moved into place only once it is complete.
+    """
+    tmp_filename = filename + ".tmp"
+    try:
+        with open(tmp_filename, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=FIELDS)
+            writer.writeheader()
+            for start in range(0, len(transactions), 1000):
+                if progress is not None:
+                    progress(start / len(transactions))
+                writer.writerows(tx.to_dict() for tx in transactions[start:start + 1000])
+        os.replace(tmp_filename, filename)
+    except BaseException:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        raise
+
+
+class PortfolioStore:
+    """
+    Snapshot + journal storage for a single portfolio file.
+    Existing portfolio.json files are used as the snapshot as they are;
+    transactions saved without an id get one on the first load.
+    """
+    def __init__(self, path, compact_every=COMPACT_EVERY):
+        self.path = path
+        self.journal_path = os.path.splitext(path)[0] + ".journal"
+        self.checkpoints_path = os.path.splitext(path)[0] + ".lots.json"
+        self.compact_every = compact_every
+        self.pending = 0  # Records in the journal that are not in the snapshot yet
+        self._base = None
+        self._journal = None
+
+    def exists(self):
+        return os.path.exists(self.path) or os.path.exists(self.journal_path)
+
+    @instrument("storage.load")
+    def load(self):
+        """
+        Reads the snapshot, replays the journal on top of it and returns the
+        transactions as an insertion-ordered dict of Transaction records
+        keyed by id. Each date is parsed exactly once, here.
+        A torn last journal line (a crash in the middle of an append) is
+        discarded; any other damage raises json.JSONDecodeError.
+        """
+        self.close()
+        result, migrated = self._read(repair=True)
+        if migrated:
+            # Persist the new ids right away so deletes can refer to them
+            self.compact(result)
+        return result
+
+    @instrument("storage.read")
+    def read(self):
+        """
+        Returns the transactions like load(), but never writes to disk: a
+        torn or stale journal is skipped and left as it is, and ids missing
+        from old files are only made up in memory. Those ids are derived from
+        the file and the position in it, so the FIFO checkpoints cached for
+        an unchanged file still match on the next run. For reading
+        portfolios without taking them over, as the batch mode does.
+        """
+        self.close()
+        return self._read(repair=False)[0]
+
+    def _read(self, repair):
+        """Returns (transactions, whether any had to be given an id)."""
+        transactions = []
+        self._base = None
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                data = f.read()
+            transactions = json.loads(data.decode('utf-8'))
+            self._base = hashlib.sha256(data).hexdigest()
+
+        self.pending = 0
+        records = self._read_journal(repair)
+        if records and records[0].get('base') != self._base:
+            # Left over from an interrupted compaction; already in the snapshot
+            if repair:
+                os.remove(self.journal_path)
+            records = []
+
+        live = dict(enumerate(transactions))
+        by_id = {tx['id']: i for i, tx in live.items() if 'id' in tx}
+        next_index = len(transactions)
+        for record in records[1:]:
+            if record['op'] == 'add':
+                tx = record['tx']
+                live[next_index] = tx
+                by_id[tx['id']] = next_index
+                next_index += 1
+            else:
+                live.pop(by_id.pop(record['id'], None), None)
+            self.pending += 1
+
+        result = {}
+        migrated = False
+        for i, d in live.items():
+            if 'id' not in d:
+                d['id'] = new_transaction_id() if repair else self._position_id(i)
+                migrated = True
+            result[d['id']] = Transaction.from_dict(d)
+        return result, migrated
+
+    def _position_id(self, index):
+        """A stable id for the transaction at index in the snapshot, for files saved without ids."""
+        return uuid.uuid5(uuid.NAMESPACE_URL, f"{os.path.abspath(self.path)}#{index}").hex
+
+    def _read_journal(self, repair=True):
+        """
+        Returns the journal records, dropping a torn last line. With repair,
+        the torn line is cut off the file and an empty journal is removed.
+        """
+        if not os.path.exists(self.journal_path):
+            return []
+        with open(self.journal_path, 'rb') as f:
+            lines = f.read().split(b"\n")
+
+        # Everything after the last newline is an incomplete record
+        if lines[-1] and repair:
+            good_size = sum(len(line) + 1 for line in lines[:-1])
+            with open(self.journal_path, 'r+b') as f:
+                f.truncate(good_size)
+        records = [json.loads(line.decode('utf-8')) for line in lines[:-1] if line.strip()]
+        if not records and repair:
+            os.remove(self.journal_path)
+        return records
+
+    @instrument("storage.append")
+    def append(self, added=(), deleted=()):
+        """Appends add and delete records to the journal and fsyncs them."""
+        lines = [{"op": "add", "tx": tx.to_dict()} for tx in added]
+        lines += [{"op": "del", "id": tx.id} for tx in deleted]
+        if not lines:
+            return
+
+        if self._journal is None:
+            new_journal = not os.path.exists(self.journal_path)
+            self._journal = open(self.journal_path, 'a', encoding='utf-8', newline='\n')
+            if new_journal:
+                lines.insert(0, {"base": self._base})
+
+        self._journal.write("".join(json.dumps(line, ensure_ascii=False) + "\n" for line in lines))
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        self.pending += len(added) + len(deleted)
+
+    def needs_compaction(self):
+        return self.pending >= self.compact_every
+
+    @instrument("storage.compact")
+    def compact(self, transactions):
+        """
+        Writes all transactions (a dict of Transaction records keyed by id) to
+        a new snapshot and drops the journal.
+        The snapshot is written to a temporary file and moved into place,
+        so portfolio.json is never left half-written.
+        """
+        self.close()
+        data = json.dumps([tx.to_dict() for tx in transactions.values()], indent=4, ensure_ascii=False).encode('utf-8')
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._base = hashlib.sha256(data).hexdigest()
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        self.pending = 0
+
+    def load_checkpoints(self):
+        """Returns the cached FIFO checkpoints, or {} if there are none that can be read."""
+        return read_checkpoints(self.checkpoints_path)
+
+    def save_checkpoints(self, checkpoints):
+        """Writes the FIFO checkpoints (see FifoEngine.export_checkpoints) to the cache file."""
+        write_checkpoints(self.checkpoints_path, checkpoints)
+
+    def close(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+
+def read_checkpoints(path):
+    """Returns the FIFO checkpoints cached in the given file, or {} if there are none that can be read."""
+    try:
+        with open(path, 'rb') as f:
+            data = json.loads(f.read().decode('utf-8'))
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def write_checkpoints(path, checkpoints):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoints, f, separators=(',', ':'))
+    os.replace(tmp_path, path)
@@ -0,0 +1,295 @@
+"""
+Row model of the transaction table, independent of any widget.
+
+The rows are kept sorted by the transactions' sort key (date, then entry
+order), so a new transaction is placed with a binary search instead of
+re-sorting the whole list, and the table widget can ask for just the slice
+of rows it is currently showing.
+
+The filter bar is answered from indexes kept next to the rows and updated
+with every insert and removal, never rebuilt per keystroke:
+
+* the rows themselves are in date order, so a date range is two bisects;
+* a sorted list of the distinct tickers turns a ticker prefix into a range
+  of tickers. A narrow prefix is answered from each ticker's own
+  date-ordered rows. A broad one, matching many rows, instead becomes a
+  mask over the row order, from a list of the rows' tickers;
+* one bitmap per transaction type (a byte per row, in row order) selects
+  buys or sales.
+
+Only the value range has no index; it is checked, from a list of the row
+values kept in row order, on the rows the other criteria leave. The masks
+are applied with itertools.compress, in C, and the result is a list of
+matching row ids; the table still creates Tk items only for the visible
+part of it.
+"""
+from bisect import bisect_left, insort
+from collections import namedtuple
+from itertools import compress
+from operator import attrgetter
+
+from slotax.diagnostics import instrument
+from slotax.model import EUR, TxType, date_key
+
+# Criteria of the filter bar; None leaves a criterion out. ticker is a prefix,
+# type a TxType, start and end inclusive date ordinals, min_value and
+# max_value bounds of the row's total value (quantity * price, as shown).
+# A ticker prefix covering less than 1/NARROW_SHARE of the rows is answered from
+# the rows of each ticker, a broader one with a mask over all rows
+NARROW_SHARE = 16
+
+RowFilter = namedtuple("RowFilter", "ticker type start end min_value max_value",
+                       defaults=(None, None, None, None, None, None))
+
+
+def format_row(tx):
+    """Returns the values shown in the table for one transaction."""
+    total_value = tx.quantity * tx.price
+    # Amounts in other currencies are shown as entered, with the currency code
+    suffix = "" if tx.currency == EUR else f" {tx.currency}"
+    return (
+        tx.date,
+        tx.type.label,
+        tx.ticker,
+        f"{tx.quantity:.4f}",
+        f"{tx.price:.4f}{suffix}",
+        f"{tx.costs:.4f}{suffix}",
+        f"{total_value:.2f}{suffix}"
+    )
+
+
+def row_value(tx):
+    return tx.quantity * tx.price
+
+
+def matches(row_filter, tx):
+    """Tells whether a transaction meets every criterion of the filter."""
+    ticker, tx_type, start, end, min_value, max_value = row_filter
+    if ticker is not None and not tx.ticker.startswith(ticker):
+        return False
+    if tx_type is not None and tx.type != tx_type:
+        return False
+    if (start is not None and tx.ordinal < start) or (end is not None and tx.ordinal > end):
+        return False
+    if min_value is not None or max_value is not None:
+        value = row_value(tx)
+        if (min_value is not None and value < min_value) or (max_value is not None and value > max_value):
+            return False
+    return True
+
+
+class SortedRows:
+    """
+    Transactions in display order. Rows are identified by the transaction
+    id, which the table widget also uses as its Treeview item id.
+    While a filter is set, len(), iids() and index() only count the rows
+    that match it; `in` and item access still see every row.
+    """
+    def __init__(self):
+        self._keys = []   # Transaction sort keys, ascending
+        self._iids = []   # Row iids in the same order as _keys
+        self._rows = {}   # iid -> transaction
+        self._values = []  # row_value() of each row, in the same order as _keys
+        self._type_masks = {tx_type: bytearray() for tx_type in TxType}  # 1 where the row has that type
+        self._tickers = []       # Distinct tickers, sorted
+        self._ticker_rows = {}   # Ticker -> (sort keys, iids) of its rows, ascending
+        self._row_tickers = []   # Ticker of each row, in the same order as _keys
+        self.filter = None
+        self._view_keys = []     # Sort keys and iids of the matching rows, while filtered
+        self._view_iids = []
+
+    def __len__(self):
+        return len(self._view_iids) if self.filter is not None else len(self._iids)
+
+    @property
+    def total(self):
+        """Number of rows, matching the filter or not."""
+        return len(self._iids)
+
+    def __getitem__(self, iid):
+        return self._rows[iid]
+
+    def __contains__(self, iid):
+        return iid in self._rows
+
+    @instrument("rows.load")
+    def load(self, transactions):
+        """Replaces all rows, sorting them once."""
+        ordered = sorted(transactions, key=attrgetter('key'))
+        self._keys = [tx.key for tx in ordered]
+        self._iids = [tx.id for tx in ordered]
+        self._rows = {tx.id: tx for tx in ordered}
+        self._build_indexes()
+
+    def _build_indexes(self):
+        ordered = [self._rows[iid] for iid in self._iids]
+        self._values = [row_value(tx) for tx in ordered]
+        self._type_masks = {tx_type: bytearray(tx.type == tx_type for tx in ordered) for tx_type in TxType}
+        self._ticker_rows = {}
+        for tx in ordered:
+            rows = self._ticker_rows.get(tx.ticker)
+            if rows is None:
+                rows = self._ticker_rows[tx.ticker] = ([], [])
+            rows[0].append(tx.key)
+            rows[1].append(tx.id)
+        self._tickers = sorted(self._ticker_rows)
+        self._row_tickers = [tx.ticker for tx in ordered]
+        self.set_filter(self.filter)
+
+    def insert(self, tx):
+        """Inserts a transaction at its sorted position and returns its iid."""
+        i = bisect_left(self._keys, tx.key)
+        self._keys.insert(i, tx.key)
+        self._iids.insert(i, tx.id)
+        self._rows[tx.id] = tx
+        self._values.insert(i, row_value(tx))
+        for tx_type, mask in self._type_masks.items():
+            mask.insert(i, tx.type == tx_type)
+
+        rows = self._ticker_rows.get(tx.ticker)
+        if rows is None:
+            rows = self._ticker_rows[tx.ticker] = ([], [])
+            insort(self._tickers, tx.ticker)
+        self._row_tickers.insert(i, tx.ticker)
+        j = bisect_left(rows[0], tx.key)
+        rows[0].insert(j, tx.key)
+        rows[1].insert(j, tx.id)
+
+        if self.filter is not None and matches(self.filter, tx):
+            j = bisect_left(self._view_keys, tx.key)
+            self._view_keys.insert(j, tx.key)
+            self._view_iids.insert(j, tx.id)
+        return tx.id
+
+    def remove(self, iid):
+        """Removes a row and returns its transaction."""
+        tx = self._rows.pop(iid)
+        i = bisect_left(self._keys, tx.key)
+        del self._keys[i]
+        del self._iids[i]
+        del self._values[i]
+        for mask in self._type_masks.values():
+            del mask[i]
+        del self._row_tickers[i]
+
+        keys, iids = self._ticker_rows[tx.ticker]
+        j = bisect_left(keys, tx.key)
+        del keys[j]
+        del iids[j]
+        if not keys:
+            del self._ticker_rows[tx.ticker]
+            del self._tickers[bisect_left(self._tickers, tx.ticker)]
+
+        if self.filter is not None:
+            j = bisect_left(self._view_keys, tx.key)
+            if j < len(self._view_keys) and self._view_keys[j] == tx.key:
+                del self._view_keys[j]
+                del self._view_iids[j]
+        return tx
+
+    def remove_many(self, iids):
+        """
+        Removes several rows and returns their transactions. Large batches
+        are filtered out in a single pass instead of one list deletion each.
+        """
+        if len(iids) < 64:
+            return [self.remove(iid) for iid in iids]
+        removed = [self._rows.pop(iid) for iid in iids]
+        kept = [(key, iid) for key, iid in zip(self._keys, self._iids) if iid in self._rows]
+        self._keys = [key for key, _ in kept]
+        self._iids = [iid for _, iid in kept]
+        self._build_indexes()
+        return removed
+
+    def index(self, iid):
+        """Returns the position of a row, or None if the filter hides it."""
+        key = self._rows[iid].key
+        if self.filter is None:
+            return bisect_left(self._keys, key)
+        i = bisect_left(self._view_keys, key)
+        return i if i < len(self._view_keys) and self._view_keys[i] == key else None
+
+    def iids(self, start=0, stop=None):
+        """Returns the iids of the rows between the start and stop positions."""
+        if self.filter is not None:
+            return self._view_iids[start:stop]
+        return self._iids[start:stop]
+
+    @instrument("rows.filter")
+    def set_filter(self, row_filter):
+        """
+        Shows only the rows matching row_filter (a RowFilter), or all rows
+        if it is None or leaves every criterion out. Returns the number of
+        rows shown.
+        """
+        if row_filter is None or all(value is None for value in row_filter):
+            self.filter = None
+            self._view_keys = []
+            self._view_iids = []
+            return len(self._iids)
+        self.filter = row_filter
+        self._view_keys, self._view_iids = self._select(row_filter)
+        return len(self._view_iids)
+
+    def _select(self, row_filter):
+        ticker, tx_type, start, end, min_value, max_value = row_filter
+        first_key = date_key(start) if start is not None else None
+        stop_key = date_key(end + 1) if end is not None else None
+
+        names = None
+        if ticker is not None:
+            # Tickers sharing the prefix are adjacent in sorted order
+            first = bisect_left(self._tickers, ticker)
+            stop = bisect_left(self._tickers, ticker[:-1] + chr(ord(ticker[-1]) + 1)) if ticker else len(self._tickers)
+            names = self._tickers[first:stop]
+            if sum(len(self._ticker_rows[name][0]) for name in names) * NARROW_SHARE < len(self._keys):
+                return self._select_tickers(names, first_key, stop_key, tx_type, min_value, max_value)
+
+        a = bisect_left(self._keys, first_key) if first_key is not None else 0
+        b = bisect_left(self._keys, stop_key) if stop_key is not None else len(self._keys)
+        whole = a == 0 and b == len(self._keys)
+
+        def part(rows):
+            return rows if whole else rows[a:b]
+
+        # Each mask is a byte per row left by the masks before it
+        masks = []
+
+        def select(rows):
+            for mask in masks:
+                rows = compress(rows, mask)
+            return rows
+
+        if tx_type is not None:
+            masks.append(self._type_masks[tx_type][a:b])
+        if names is not None:
+            masks.append(bytes(map(set(names).__contains__, select(part(self._row_tickers)))))
+        if min_value is not None:
+            masks.append(bytes(map(float(min_value).__le__, select(part(self._values)))))
+        if max_value is not None:
+            masks.append(bytes(map(float(max_value).__ge__, select(part(self._values)))))
+        return list(select(part(self._keys))), list(select(part(self._iids)))
+
+    def _select_tickers(self, names, first_key, stop_key, tx_type, min_value, max_value):
+        """_select() for a prefix matching few rows, from the rows of each ticker."""
+        pairs = []
+        for name in names:
+            keys, iids = self._ticker_rows[name]
+            a = bisect_left(keys, first_key) if first_key is not None else 0
+            b = bisect_left(keys, stop_key) if stop_key is not None else len(keys)
+            pairs.extend(zip(keys[a:b], iids[a:b]))
+        if len(names) > 1:
+            # Each ticker's rows are already in date order; timsort merges the runs
+            pairs.sort()
+        rows = self._rows
+        if tx_type is not None:
+            pairs = [(key, iid) for key, iid in pairs if rows[iid].type == tx_type]
+        if min_value is not None or max_value is not None:
+            low, high = _value_bounds(min_value, max_value)
+            pairs = [(key, iid) for key, iid in pairs if low <= row_value(rows[iid]) <= high]
+        return [key for key, _ in pairs], [iid for _, iid in pairs]
+
+
+def _value_bounds(min_value, max_value):
+    return (min_value if min_value is not None else float("-inf"),
+            max_value if max_value is not None else float("inf"))
@@ -0,0 +1,137 @@
+"""
+What-if sales: the gain and tax of selling N units of a ticker on a date,
+without adding the sale or writing an XML file.
+
+The open lots a sale on a given date would draw from are turned into prefix
+sums of quantity and cost basis once. Each lot's cost basis includes its
+prorated buy costs, exactly as in the Doh-KDVP export. Any quantity then
+resolves with a binary search over the prefix sums, so sweeping quantities
+is O(log lots) per point. The tax is split by holding period the same way,
+because FIFO uses the oldest lots first and lots of one holding band are
+therefore adjacent.
+"""
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from datetime import date
+
+from slotax.fxrates import eur_price_costs
+from slotax.model import SCALE
+
+# Capital gains tax rate by full years of holding (ZDoh-2); the first matching row applies.
+# The rates change from time to time; check them before relying on the estimate.
+TAX_RATES = ((15, 0.0), (10, 0.15), (5, 0.20), (0, 0.275))
+
+SaleEstimate = namedtuple("SaleEstimate", "quantity proceeds cost_basis gain tax")
+
+
+def years_before(ordinal, years):
+    """Ordinal of the same day the given number of years earlier (29 February becomes 28)."""
+    day = date.fromordinal(ordinal)
+    try:
+        return day.replace(year=day.year - years).toordinal()
+    except ValueError:
+        return day.replace(year=day.year - years, day=28).toordinal()
+
+
+class LotIndex:
+    """
+    Prefix sums over the open lots of one ticker for a sale on one date.
+    quantities[i] and costs[i] hold the fixed-point quantity and the cost
+    basis of the first i lots, in EUR at each buy's reference rate.
+    """
+    def __init__(self, lots, ordinal, rates=None):
+        self.ordinal = ordinal
+        self.buy_ordinals = []
+        self.unit_costs = []  # Cost basis per unit: price plus buy costs per unit
+        self.quantities = [0]
+        self.costs = [0.0]
+        for buy, remaining in lots:
+            price, costs = eur_price_costs(buy, rates)
+            unit_cost = price + (costs / buy.quantity if buy.quantity > 0 else 0)
+            self.buy_ordinals.append(buy.ordinal)
+            self.unit_costs.append(unit_cost)
+            self.quantities.append(self.quantities[-1] + remaining)
+            self.costs.append(self.costs[-1] + remaining / SCALE * unit_cost)
+
+    @property
+    def available(self):
+        return self.quantities[-1] / SCALE
+
+    def cost_basis(self, quantity_fp):
+        """Cost basis of the first quantity_fp units, by FIFO."""
+        if quantity_fp <= 0:
+            return 0.0
+        # The lot that the last unit comes from
+        i = bisect_left(self.quantities, quantity_fp, 1) - 1
+        return self.costs[i] + (quantity_fp - self.quantities[i]) / SCALE * self.unit_costs[i]
+
+    def held_since(self, ordinal):
+        """Fixed-point quantity in the lots bought on or before the given date."""
+        return self.quantities[bisect_right(self.buy_ordinals, ordinal)]
+
+
+class SaleSimulator:
+    """
+    Answers what-if sales against a FifoEngine. The lot index of a ticker
+    and date is built once and reused until that ticker changes. The sale
+    price and costs are in EUR; non-EUR buys are converted with rates.
+    """
+    def __init__(self, engine, rates=None, tax_rates=TAX_RATES):
+        self.engine = engine
+        self.rates = rates
+        self.tax_rates = tax_rates
+        self._cache = {}  # Ticker -> (ledger, ledger.changes, LotIndex)
+
+    def lot_index(self, ticker, ordinal):
+        """
+        Returns the LotIndex for a sale of ticker on the given date. Raises
+        KeyError for an unknown ticker and InsufficientLotsError if earlier
+        sales are not covered.
+        """
+        ledger = self.engine.ledgers[ticker]
+        cached = self._cache.get(ticker)
+        if cached is not None and cached[0] is ledger and cached[1] == ledger.changes \
+                and cached[2].ordinal == ordinal:
+            return cached[2]
+        index = LotIndex(ledger.open_lots(ordinal), ordinal, self.rates)
+        self._cache[ticker] = (ledger, ledger.changes, index)
+        return index
+
+    def simulate(self, ticker, ordinal, quantity, price, costs=0.0):
+        """
+        Estimates selling quantity units of ticker on the date (an ordinal)
+        at price, with the given total sale costs. Raises ValueError if fewer
+        units are held on that date.
+        """
+        index = self.lot_index(ticker, ordinal)
+        quantity_fp = round(quantity * SCALE)
+        if quantity_fp > index.quantities[-1]:
+            raise ValueError(f"Na ta dan je na voljo le {index.available:.4f} enot {ticker}.")
+        return self._estimate(index, quantity_fp, price, costs)
+
+    def curve(self, ticker, ordinal, price, costs=0.0, points=100):
+        """
+        Returns SaleEstimates for points quantities evenly spread up to
+        everything held on the date. The sale costs are taken as fixed per sale.
+        """
+        index = self.lot_index(ticker, ordinal)
+        total = index.quantities[-1]
+        return [self._estimate(index, total * n // points, price, costs) for n in range(1, points + 1)]
+
+    def _estimate(self, index, quantity_fp, price, costs):
+        quantity = quantity_fp / SCALE
+        proceeds = price * quantity - costs
+        cost_basis = index.cost_basis(quantity_fp)
+
+        # Split the sold units into holding bands, oldest lots first
+        tax = 0.0
+        sold = 0
+        for years, rate in self.tax_rates:
+            band_end = min(quantity_fp, index.held_since(years_before(index.ordinal, years)))
+            if band_end > sold:
+                band_proceeds = proceeds * (band_end - sold) / quantity_fp
+                band_cost = index.cost_basis(band_end) - index.cost_basis(sold)
+                tax += rate * (band_proceeds - band_cost)
+                sold = band_end
+        # A loss is not taxed; what it saves depends on the rest of the year
+        return SaleEstimate(quantity, proceeds, cost_basis, proceeds - cost_basis, max(tax, 0.0))
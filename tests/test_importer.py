@@ -0,0 +1,23 @@
+import unittest
+from datetime import date
+
+from slotax.importer import iter_statement_text
+from slotax.model import TxType
+
+
+class StatementTextTest(unittest.TestCase):
+    def test_row_between_trades_keeps_their_dates(self):
+        text = (
+            "02 Jan. 2024 Handel Sparplanausführung IE00BK5BQT80 FTSE All-World, quantity: 0.384615 25,00 €\n"
+            "15 Feb. 2024 Zinsen Zinszahlung 1,23 €\n"
+            "03 März 2024 Handel Verkauf IE00BK5BQT80 FTSE All-World, quantity: 1 110,00 €\n"
+        )
+        buy, sale = iter_statement_text(text)
+        self.assertEqual((buy.ordinal, buy.type), (date(2024, 1, 2).toordinal(), TxType.BUY))
+        self.assertEqual((sale.ordinal, sale.type), (date(2024, 3, 3).toordinal(), TxType.SELL))
+        self.assertEqual(sale.quantity, 1)
+        self.assertEqual(sale.price, 110)
+
+
+if __name__ == "__main__":
+    unittest.main()